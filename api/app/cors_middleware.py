@@ -1,6 +1,6 @@
 # Updated api/app/cors_middleware.py - Fix protocol mismatch
 
-from fastapi import Request, Response
+from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from typing import Optional, List
 import httpx
@@ -11,12 +11,22 @@ import time
 
 logger = logging.getLogger(__name__)
 
+# Static preflight response headers, encoded once at import
+PREFLIGHT_HEADERS = [
+    (b"access-control-allow-credentials", b"true"),
+    (b"access-control-allow-methods", b"GET, POST, PUT, DELETE, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type, Authorization, X-Requested-With"),
+    (b"access-control-max-age", b"86400"),
+]
+
 class DynamicCORSMiddleware(BaseHTTPMiddleware):
     """Dynamic CORS middleware that fetches allowed origins from pixel-management"""
     
-    def __init__(self, app, pixel_management_url: str):
+    def __init__(self, app, pixel_management_url: str, http_client: Optional[httpx.AsyncClient] = None):
         super().__init__(app)
         self.pixel_management_url = pixel_management_url
+        # Reuse the caller's pooled client when given, otherwise keep one for the middleware's lifetime
+        self.http_client = http_client or httpx.AsyncClient(timeout=5.0)
         self.cache: Optional[dict] = None
         self.cache_timestamp: float = 0
         self.cache_ttl: int = 300  # 5 minutes
@@ -47,24 +57,24 @@ class DynamicCORSMiddleware(BaseHTTPMiddleware):
         
         # Fetch from pixel-management
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(
-                    f"{self.pixel_management_url}/api/v1/domains/all"
-                )
+            response = await self.http_client.get(
+                f"{self.pixel_management_url}/api/v1/domains/all",
+                timeout=5.0
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                domains = data.get("domains", [])
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    domains = data.get("domains", [])
-                    
-                    # Thread-safe cache update
-                    with self._lock:
-                        self.cache = {"domains": domains}
-                        self.cache_timestamp = current_time
-                    
-                    logger.info(f"Updated CORS allowed origins: {len(domains)} domains")
-                    return domains
-                else:
-                    logger.warning(f"Failed to fetch domains: HTTP {response.status_code}")
+                # Thread-safe cache update
+                with self._lock:
+                    self.cache = {"domains": domains}
+                    self.cache_timestamp = current_time
+                
+                logger.info(f"Updated CORS allowed origins: {len(domains)} domains")
+                return domains
+            else:
+                logger.warning(f"Failed to fetch domains: HTTP {response.status_code}")
                     
         except Exception as e:
             logger.error(f"Error fetching allowed origins: {e}")
@@ -73,34 +83,43 @@ class DynamicCORSMiddleware(BaseHTTPMiddleware):
         logger.error("No CORS origins available - denying all cross-origin requests")
         return []
     
-    async def dispatch(self, request: Request, call_next):
-        """Handle CORS for all requests"""
-        origin = request.headers.get("origin")
+    async def __call__(self, scope, receive, send):
+        """Answer preflights at the ASGI layer, skipping request wrapping and the inner stack"""
+        if scope["type"] == "http" and scope["method"] == "OPTIONS":
+            await self.handle_preflight(scope, send)
+            return
+        
+        await super().__call__(scope, receive, send)
+    
+    async def handle_preflight(self, scope, send):
+        """Send a preflight response straight from raw scope headers"""
+        origin = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+                break
+        
+        status = 403
+        headers = [(b"content-length", b"0")]
         
-        # Handle preflight requests
-        if request.method == "OPTIONS":
+        if origin:
+            origin_domain = self.extract_domain_from_origin(origin.decode("latin-1"))
             allowed_domains = await self.get_allowed_origins()
             
-            if origin:
-                origin_domain = self.extract_domain_from_origin(origin)
-                
-                if origin_domain in allowed_domains:
-                    return Response(
-                        status_code=200,
-                        headers={
-                            "Access-Control-Allow-Origin": origin,
-                            "Access-Control-Allow-Credentials": "true",
-                            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-                            "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Requested-With",
-                            "Access-Control-Max-Age": "3600"
-                        }
-                    )
-                else:
-                    logger.warning(f"CORS preflight rejected for origin: {origin} (domain: {origin_domain})")
-                    return Response(status_code=403)
+            if origin_domain in allowed_domains:
+                status = 204
+                headers = [(b"access-control-allow-origin", origin)] + PREFLIGHT_HEADERS
             else:
-                logger.warning("CORS preflight rejected: no origin header")
-                return Response(status_code=403)
+                logger.warning(f"CORS preflight rejected for origin: {origin.decode('latin-1')} (domain: {origin_domain})")
+        else:
+            logger.warning("CORS preflight rejected: no origin header")
+        
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+    
+    async def dispatch(self, request: Request, call_next):
+        """Handle CORS for non-preflight requests"""
+        origin = request.headers.get("origin")
         
         # Process actual request
         response = await call_next(request)
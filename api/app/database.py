@@ -12,11 +12,13 @@ engine = create_engine(
     # Connection pool optimizations for development
     pool_size=10,                    # Reduced for local development
     max_overflow=20,                 # Smaller overflow for MacBook
-    pool_pre_ping=True,              # Verify connections are alive
+    pool_pre_ping=False,             # Skip the per-checkout ping round-trip; rely on pool_recycle
     pool_recycle=3600,               # Recycle connections every hour
     
     # Write performance optimizations
     echo=False,                      # Disable query logging in production
+    insertmanyvalues_page_size=1000, # Rows per multi-row VALUES statement for Core/ORM inserts
+    executemany_mode="values_plus_batch",  # execute_batch for non-INSERT executemany (e.g. UPDATEs)
 )
 
 # Create SessionLocal class with optimized settings
@@ -35,4 +37,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Dependency for read-only endpoints: a pooled connection without Session/unit-of-work setup
+def get_ro_conn():
+    with engine.connect() as conn:
+        yield conn
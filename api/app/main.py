@@ -1,24 +1,32 @@
 from fastapi import FastAPI, Request, HTTPException, Depends, BackgroundTasks, Path
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import Response
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from sqlalchemy import text
+from sqlalchemy.engine import Connection
 from datetime import datetime
 import json
 import logging
+import orjson
 import os
+import re
+import socket
 import threading
 import time
 import httpx
-from ipaddress import ip_address, AddressValueError
+from collections import OrderedDict
+from psycopg2.extras import execute_values
+from functools import lru_cache
 from typing import Optional, List, Dict, Any, Tuple
 
-from .database import engine, get_db, DATABASE_URL
-from .models import Base, EventLog
+from .database import engine, SessionLocal, get_ro_conn, DATABASE_URL
+from .models import Base
 from .s3_export import create_s3_exporter
 from .rate_limiter import RateLimitMiddleware
 from .cors_middleware import DynamicCORSMiddleware
 from .validation_schemas import CollectionRequest
-from .validation_middleware import RequestValidationMiddleware
+from .validation_middleware import RequestValidationMiddleware, MAX_REQUEST_SIZE
 from .error_handler import custom_general_exception_handler
 
 # Set up logging
@@ -39,17 +47,23 @@ except Exception as e:
 # Set pixel management endpoint 
 PIXEL_MANAGEMENT_URL = os.getenv("PIXEL_MANAGEMENT_URL", "https://pixel-management-275731808857.us-central1.run.app")
 
+# Long-lived pooled client for pixel-management: keep-alive connections skip a TCP+TLS handshake per lookup
+pixel_management_client = httpx.AsyncClient(
+    base_url=PIXEL_MANAGEMENT_URL,
+    timeout=10.0,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+)
+
 async def get_client_id_for_domain(domain: str) -> str:
     """Get client_id for a domain from pixel-management"""
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{PIXEL_MANAGEMENT_URL}/api/v1/config/domain/{domain}")
-            if response.status_code == 200:
-                config = response.json()
-                return config.get("client_id", f"unknown_{domain}")
-            else:
-                logger.warning(f"Domain {domain} not authorized: HTTP {response.status_code}")
-                return f"unauthorized_{domain}"
+        response = await pixel_management_client.get(f"/api/v1/config/domain/{domain}")
+        if response.status_code == 200:
+            config = response.json()
+            return config.get("client_id", f"unknown_{domain}")
+        else:
+            logger.warning(f"Domain {domain} not authorized: HTTP {response.status_code}")
+            return f"unauthorized_{domain}"
     except Exception as e:
         logger.error(f"Failed to get client config for domain {domain}: {e}")
         return f"error_{domain}"
@@ -57,9 +71,19 @@ async def get_client_id_for_domain(domain: str) -> str:
 app = FastAPI(title="Analytics API", version="1.0.0")
 
 # Add security middleware in correct order
-app.add_middleware(DynamicCORSMiddleware, pixel_management_url=PIXEL_MANAGEMENT_URL)
 app.add_middleware(RequestValidationMiddleware)
 app.add_middleware(RateLimitMiddleware)
+# Registered last so it is outermost: preflights are answered before validation and rate limiting
+app.add_middleware(
+    DynamicCORSMiddleware,
+    pixel_management_url=PIXEL_MANAGEMENT_URL,
+    http_client=pixel_management_client
+)
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Close pooled pixel-management connections"""
+    await pixel_management_client.aclose()
 
 # Add exception handlers for secure error responses
 app.add_exception_handler(Exception, custom_general_exception_handler)
@@ -69,34 +93,69 @@ app.add_exception_handler(Exception, custom_general_exception_handler)
 # ============================================================================
 
 class ConfigCache:
-    def __init__(self, ttl_seconds: int = 300):  # 5 minute TTL
-        self.cache: Dict[str, Tuple[Dict[str, Any], float]] = {}
+    """TTL cache bounded by a segmented LRU (an LRU-2 approximation)
+    
+    Keys seen once sit in a probation segment and are evicted first; a second hit promotes them
+    to the protected segment, so a burst of one-off clients cannot flush the recurring ones.
+    """
+    
+    def __init__(self, ttl_seconds: int = 300, max_entries: int = 1024):  # 5 minute TTL
+        # key -> (data, monotonic expiry), oldest first
+        self.probation: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self.protected: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
         self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.protected_max = max(1, int(max_entries * 0.8))
         self._lock = threading.Lock()
     
     def get(self, key: str) -> Optional[Dict[str, Any]]:
         with self._lock:
-            if key not in self.cache:
+            segment = self.protected if key in self.protected else self.probation
+            entry = segment.get(key)
+            if entry is None:
                 return None
-                
-            data, timestamp = self.cache[key]
-            if time.time() - timestamp > self.ttl_seconds:
-                # Cache expired - remove atomically
-                del self.cache[key]
+            
+            data, expiry = entry
+            if expiry <= time.monotonic():
+                # Cache expired
+                del segment[key]
                 return None
-                
+            
+            if segment is self.protected:
+                self.protected.move_to_end(key)
+            else:
+                # Second hit: promote, demoting the coldest protected entry if the segment is full
+                del self.probation[key]
+                self.protected[key] = entry
+                if len(self.protected) > self.protected_max:
+                    demoted_key, demoted = self.protected.popitem(last=False)
+                    self.probation[demoted_key] = demoted
             return data
     
     def set(self, key: str, data: Dict[str, Any]):
         with self._lock:
-            self.cache[key] = (data, time.time())
+            entry = (data, time.monotonic() + self.ttl_seconds)
+            if key in self.protected:
+                self.protected[key] = entry
+                self.protected.move_to_end(key)
+            else:
+                self.probation.pop(key, None)
+                self.probation[key] = entry
+            
+            # Evict from probation first, so entries that were only ever seen once go before hot ones
+            while len(self.probation) + len(self.protected) > self.max_entries:
+                if self.probation:
+                    self.probation.popitem(last=False)
+                else:
+                    self.protected.popitem(last=False)
     
     def clear(self):
         with self._lock:
-            self.cache.clear()
+            self.probation.clear()
+            self.protected.clear()
 
 # Global cache instance
-config_cache = ConfigCache(ttl_seconds=300)  # 5 minute cache
+config_cache = ConfigCache(ttl_seconds=300, max_entries=1024)  # 5 minute cache
 
 # ============================================================================
 # Pixel Management Service Integration
@@ -112,27 +171,26 @@ async def get_client_config(client_id: str) -> Dict[str, Any]:
         return cached_config
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{PIXEL_MANAGEMENT_URL}/api/v1/config/client/{client_id}",
-                timeout=5.0
-            )
-            
-            if response.status_code == 404:
-                logger.warning(f"Client {client_id} not found")
-                raise HTTPException(status_code=404, detail="Client not found or inactive")
-            
-            if response.status_code != 200:
-                logger.error(f"Config service error for client {client_id}: {response.status_code}")
-                raise HTTPException(status_code=502, detail="Configuration service unavailable")
-            
-            config = response.json()
-            
-            # Cache the config
-            config_cache.set(client_id, config)
-            logger.info(f"Fetched and cached config for client {client_id}")
-            
-            return config
+        response = await pixel_management_client.get(
+            f"/api/v1/config/client/{client_id}",
+            timeout=5.0
+        )
+        
+        if response.status_code == 404:
+            logger.warning(f"Client {client_id} not found")
+            raise HTTPException(status_code=404, detail="Client not found or inactive")
+        
+        if response.status_code != 200:
+            logger.error(f"Config service error for client {client_id}: {response.status_code}")
+            raise HTTPException(status_code=502, detail="Configuration service unavailable")
+        
+        config = response.json()
+        
+        # Cache the config
+        config_cache.set(client_id, config)
+        logger.info(f"Fetched and cached config for client {client_id}")
+        
+        return config
             
     except httpx.RequestError as e:
         logger.error(f"Failed to connect to pixel management service: {e}")
@@ -142,22 +200,47 @@ async def get_client_config(client_id: str) -> Dict[str, Any]:
 # Utility Functions
 # ============================================================================
 
-def extract_client_ip(request: Request) -> str:
-    """Extract client IP address from request headers"""
+@lru_cache(maxsize=256)
+def validate_ip(candidate: str) -> str:
+    """Return candidate if it is a valid IPv4/IPv6 address, else the fallback (C-level inet_pton check)"""
+    try:
+        socket.inet_pton(socket.AF_INET, candidate)
+        return candidate
+    except (OSError, ValueError, TypeError):
+        pass
+    try:
+        socket.inet_pton(socket.AF_INET6, candidate)
+        return candidate
+    except (OSError, ValueError, TypeError):
+        return "127.0.0.1"  # Fallback for invalid IPs
+
+def scan_request_headers(request: Request) -> Tuple[Optional[str], str, str]:
+    """Read x-forwarded-for, user-agent and host in one pass over the raw ASGI headers"""
+    # Avoids materializing Starlette's case-insensitive Headers object for three lookups
+    forwarded_for = user_agent = host = None
+    for name, value in request.scope["headers"]:
+        if name == b"x-forwarded-for":
+            if forwarded_for is None:
+                forwarded_for = value.decode("latin-1")
+        elif name == b"user-agent":
+            if user_agent is None:
+                user_agent = value.decode("latin-1")
+        elif name == b"host":
+            if host is None:
+                host = value.decode("latin-1")
+    return forwarded_for, user_agent or "unknown", host or ""
+
+def extract_client_ip(request: Request, forwarded_for: Optional[str]) -> str:
+    """Extract client IP address from the X-Forwarded-For value or the peer address"""
     # Check common headers for real IP (in case of proxy/load balancer)
-    forwarded_for = request.headers.get("x-forwarded-for")
     if forwarded_for:
         # X-Forwarded-For can contain multiple IPs, take the first one
-        client_ip = forwarded_for.split(',')[0].strip()
+        client_ip = forwarded_for.partition(',')[0].strip()
     else:
         client_ip = request.client.host
     
-    # Validate IP address
-    try:
-        ip_address(client_ip)
-        return client_ip
-    except (AddressValueError, TypeError):
-        return "127.0.0.1"  # Fallback for invalid IPs
+    # Validate IP address (proxies repeat the same few values, so results are cached)
+    return validate_ip(client_ip)
 
 def parse_timestamp(timestamp_str: str) -> datetime:
     """Parse ISO timestamp string to datetime object"""
@@ -169,71 +252,111 @@ def parse_timestamp(timestamp_str: str) -> datetime:
     except (ValueError, TypeError):
         return datetime.utcnow()
 
+# Key fragments that mark a field as sensitive, compiled once into a single alternation
+SENSITIVE_KEY_PATTERNS = [
+    'password', 'pwd', 'pass', 'secret', 'token', 'key',
+    'email', 'mail', 'phone', 'tel', 'ssn', 'social',
+    'credit', 'card', 'cvv', 'cvc', 'billing'
+]
+SENSITIVE_KEY_RE = re.compile("|".join(map(re.escape, SENSITIVE_KEY_PATTERNS)), re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def is_sensitive_key(key: str) -> bool:
+    """True if key contains a sensitive pattern (one case-insensitive regex scan, memoized per distinct key)"""
+    return SENSITIVE_KEY_RE.search(key) is not None
+
 def redact_sensitive_data(data: Dict[str, Any]) -> Dict[str, Any]:
-    """Remove or redact potentially sensitive information"""
+    """Remove or redact potentially sensitive information (mutates data in place and returns it)"""
     if not isinstance(data, dict):
         return data
     
-    sensitive_patterns = [
-        'password', 'pwd', 'pass', 'secret', 'token', 'key',
-        'email', 'mail', 'phone', 'tel', 'ssn', 'social',
-        'credit', 'card', 'cvv', 'cvc', 'billing'
-    ]
-    
-    redacted = {}
+    # Only replaced values are written back; untouched keys and nested dicts are never copied
     for key, value in data.items():
-        key_lower = str(key).lower()
-        
         # Check if key contains sensitive pattern
-        is_sensitive = any(pattern in key_lower for pattern in sensitive_patterns)
-        
-        if is_sensitive:
-            redacted[key] = "[REDACTED]"
+        if is_sensitive_key(str(key)):
+            data[key] = "[REDACTED]"
         elif isinstance(value, dict):
-            redacted[key] = redact_sensitive_data(value)
+            redact_sensitive_data(value)
         elif isinstance(value, str) and len(value) > 100:
             # Truncate very long strings that might contain sensitive data
-            redacted[key] = value[:100] + "..."
-        else:
-            redacted[key] = value
+            data[key] = value[:100] + "..."
     
-    return redacted
+    return data
+
+# Column order for rows produced by create_event_record_row; must match INSERT_EVENTS_SQL
+EVENT_COLUMNS = (
+    "event_type", "session_id", "visitor_id", "site_id", "timestamp", "url",
+    "path", "user_agent", "ip_address", "raw_event_data", "client_id", "created_at"
+)
+
+# Multi-row VALUES insert for execute_values - event_id and export_status come from column defaults
+INSERT_EVENTS_SQL = f"INSERT INTO events_log ({', '.join(EVENT_COLUMNS)}) VALUES %s"
+INSERT_PAGE_SIZE = 1000  # Rows per INSERT statement (a full 100-event batch is one round-trip)
 
-def create_event_record(event_data: Dict[str, Any], client_ip: str, user_agent: str, event_timestamp: datetime, client_id: str) -> Dict[str, Any]:
-    """Create a standardized event record for database insertion"""
+# Background inserts run after /collect has answered, so transient DB errors are retried in place
+PERSIST_ATTEMPTS = 3
+PERSIST_RETRY_DELAY = 0.5  # Seconds before the first retry, doubled for each further retry
+
+def insert_event_rows(db: Session, rows: List[Tuple]):
+    """Insert positional rows as multi-row INSERT ... VALUES pages within the session's transaction"""
+    cursor = db.connection().connection.cursor()
+    try:
+        execute_values(cursor, INSERT_EVENTS_SQL, rows, page_size=INSERT_PAGE_SIZE)
+    finally:
+        cursor.close()
+
+def json_fragment(value: Any) -> orjson.Fragment:
+    """Pre-serialized JSON for embedding in orjson.dumps, via stdlib json for what orjson rejects"""
+    try:
+        return orjson.Fragment(orjson.dumps(value))
+    except orjson.JSONEncodeError:
+        # e.g. integers beyond 64 bits, which stdlib json stores as-is
+        return orjson.Fragment(json.dumps(value).encode())
+
+def serialize_event_data(event_data: Dict[str, Any]) -> str:
+    """event_data as a JSON string for the raw_event_data column
     
-    # Redact sensitive data from nested eventData
-    safe_event_data = redact_sensitive_data(event_data.get("eventData", {}))
+    orjson handles every normal request; values it can't encode (e.g. integers beyond 64 bits,
+    which the validators accept) fall back to stdlib json per top-level value instead of failing the request.
+    """
+    try:
+        return orjson.dumps(event_data).decode()
+    except orjson.JSONEncodeError:
+        return orjson.dumps({key: json_fragment(value) for key, value in event_data.items()}).decode()
+
+def create_event_record_row(event_data: Dict[str, Any], client_ip: str, user_agent: str, event_timestamp: datetime, client_id: str, received_at: datetime) -> Tuple:
+    """Create a positional event row (EVENT_COLUMNS order) for bulk insertion
     
-    # Create a clean copy of the complete event data for raw_event_data
-    raw_event_data = event_data.copy()
-    if "eventData" in raw_event_data:
-        raw_event_data["eventData"] = safe_event_data
+    event_data must be owned by the caller's request: its eventData is redacted in place.
+    received_at is read once per request and shared by every row it produces.
+    """
     
-    return {
-        "event_type": event_data.get("eventType", "unknown"),
-        "session_id": event_data.get("sessionId"),
-        "visitor_id": event_data.get("visitorId"),
-        "site_id": event_data.get("siteId", "unknown"),
-        "timestamp": event_timestamp,
-        "url": event_data.get("url"),
-        "path": event_data.get("path"),
-        "user_agent": user_agent,
-        "ip_address": client_ip,
-        "raw_event_data": raw_event_data,
-        "client_id": client_id,
-        "created_at": datetime.utcnow()
-    }
-
-def process_batch_events(batch_data: Dict[str, Any], client_ip: str, user_agent: str, client_id: str) -> List[Dict[str, Any]]:
-    """Process batch events and return list of events ready for insertion"""
-    individual_events = batch_data.get("events", [])
-    events_to_insert = []
+    # Redact sensitive data from nested eventData (pre-serialized fragments pass through).
+    # Callers pass the model_dump() output or a per-event dict, so no defensive copy is needed
+    if "eventData" in event_data:
+        event_data["eventData"] = redact_sensitive_data(event_data["eventData"])
     
-    # Process the batch wrapper as an event
-    batch_timestamp = parse_timestamp(batch_data.get("timestamp", ""))
-    batch_event_record = create_event_record(batch_data, client_ip, user_agent, batch_timestamp, client_id)
-    events_to_insert.append(batch_event_record)
+    return (
+        event_data.get("eventType", "unknown"),
+        event_data.get("sessionId"),
+        event_data.get("visitorId"),
+        event_data.get("siteId", "unknown"),
+        event_timestamp,
+        event_data.get("url"),
+        event_data.get("path"),
+        user_agent,
+        client_ip,
+        # Serialized once here; psycopg2 sends it as a text literal cast to JSONB
+        serialize_event_data(event_data),
+        client_id,
+        received_at
+    )
+
+def process_batch_events(batch_data: Dict[str, Any], client_ip: str, user_agent: str, client_id: str, received_at: datetime) -> List[Tuple]:
+    """Process batch events and return list of event rows ready for insertion"""
+    individual_events = batch_data.get("events", [])
+    # Slot 0 is the batch wrapper, filled in once the individual events are serialized
+    events_to_insert = [None]
     
     logger.info(f"Processing batch with {len(individual_events)} individual events for client {client_id}")
     
@@ -241,6 +364,10 @@ def process_batch_events(batch_data: Dict[str, Any], client_ip: str, user_agent:
     for individual_event in individual_events:
         event_timestamp = parse_timestamp(individual_event.get("timestamp", batch_data.get("timestamp", "")))
         
+        # Redact and serialize eventData once; the fragment is embedded verbatim both in
+        # this event's row and in the wrapper's copy of the events list
+        individual_event["eventData"] = json_fragment(redact_sensitive_data(individual_event.get("eventData", {})))
+        
         # Create complete event data by merging batch context with individual event
         complete_event_data = {
             "eventType": individual_event.get("eventType", "unknown"),
@@ -251,18 +378,74 @@ def process_batch_events(batch_data: Dict[str, Any], client_ip: str, user_agent:
             "referrer": batch_data.get("referrer"),
             "url": batch_data.get("url"),
             "path": batch_data.get("path"),
-            "eventData": individual_event.get("eventData", {}),
+            "eventData": individual_event["eventData"],
             # Include any additional context from batch
             "attribution": batch_data.get("attribution"),
             "browser": batch_data.get("browser"),
             "page": batch_data.get("page")
         }
         
-        event_record = create_event_record(complete_event_data, client_ip, user_agent, event_timestamp, client_id)
+        event_record = create_event_record_row(complete_event_data, client_ip, user_agent, event_timestamp, client_id, received_at)
         events_to_insert.append(event_record)
     
+    # Process the batch wrapper as an event
+    batch_timestamp = parse_timestamp(batch_data.get("timestamp", ""))
+    events_to_insert[0] = create_event_record_row(batch_data, client_ip, user_agent, batch_timestamp, client_id, received_at)
+    
     return events_to_insert
 
+class DroppedEventStats:
+    """Events accepted by /collect whose background insert failed on every attempt (per worker process)"""
+    
+    def __init__(self):
+        self.events = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+        self.last_dropped_at: Optional[str] = None
+        self._lock = threading.Lock()
+    
+    def record(self, event_count: int, error: Exception):
+        with self._lock:
+            self.events += event_count
+            self.batches += 1
+            self.last_error = str(error)
+            self.last_dropped_at = datetime.utcnow().isoformat()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "events": self.events,
+                "batches": self.batches,
+                "last_error": self.last_error,
+                "last_dropped_at": self.last_dropped_at
+            }
+
+dropped_events = DroppedEventStats()
+
+def persist_events(rows: List[Tuple], client_id: str):
+    """Bulk insert event rows in a short-lived session (runs as a background task)
+    
+    The response has already been sent, so a failed insert is retried with backoff; rows still
+    failing after PERSIST_ATTEMPTS are dropped and counted in dropped_events (reported by /health).
+    """
+    for attempt in range(1, PERSIST_ATTEMPTS + 1):
+        with SessionLocal() as db:
+            try:
+                insert_event_rows(db, rows)
+                db.commit()
+                logger.info(f"Bulk inserted {len(rows)} events for client {client_id}")
+                return
+            except Exception as db_error:
+                db.rollback()
+                error = db_error
+        
+        if attempt < PERSIST_ATTEMPTS:
+            logger.warning(f"Database error (attempt {attempt}/{PERSIST_ATTEMPTS}), retrying: {error}")
+            time.sleep(PERSIST_RETRY_DELAY * 2 ** (attempt - 1))
+    
+    dropped_events.record(len(rows), error)
+    logger.error(f"Database error, dropped {len(rows)} accepted events for client {client_id}: {error}")
+
 # ============================================================================
 # API Endpoints
 # ============================================================================
@@ -272,14 +455,15 @@ async def root():
     return {"message": "Analytics API is running", "timestamp": datetime.utcnow().isoformat()}
 
 @app.get("/health")
-async def health(db: Session = Depends(get_db)):
+async def health(conn: Connection = Depends(get_ro_conn)):
     """Health check with database connectivity test"""
     try:
         # Test database connection
-        db.execute(text("SELECT 1"))
+        conn.execute(text("SELECT 1"))
         return {
             "status": "healthy",
             "database": "connected",
+            "dropped_events": dropped_events.snapshot(),
             "timestamp": datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -288,10 +472,8 @@ async def health(db: Session = Depends(get_db)):
 
 @app.post("/collect")
 async def collect_events(
-    request_data: CollectionRequest,
     request: Request, 
-    background_tasks: BackgroundTasks, 
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks
 ):
     """
     Collect analytics events with comprehensive security validation
@@ -303,50 +485,54 @@ async def collect_events(
     - Bulk insert optimization for performance
     - Secure error handling
     """
+    body = await request.body()
+    # The middleware rejects oversized Content-Length up front; chunked bodies are checked here
+    if len(body) > MAX_REQUEST_SIZE:
+        logger.warning(f"Request too large: {len(body)} bytes")
+        raise HTTPException(status_code=413, detail="Request too large")
+    
+    # Parse and validate the raw body in one pydantic-core pass (no intermediate json.loads)
+    try:
+        request_data = CollectionRequest.model_validate_json(body)
+    except ValidationError as e:
+        # Same 422 shape FastAPI produces for declared body parameters
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        )
+    
     try:
         # Extract client information
-        client_ip = extract_client_ip(request)
-        user_agent = request.headers.get("user-agent", "unknown")
+        forwarded_for, user_agent, host = scan_request_headers(request)
+        client_ip = extract_client_ip(request, forwarded_for)
         
         # Get requesting domain and validate authorization
-        requesting_domain = request.headers.get("host", "").split(":")[0]
+        requesting_domain = host.partition(":")[0]
         client_id = await get_client_id_for_domain(requesting_domain)
         
         # Convert validated Pydantic model to dict for processing
-        event_data = request_data.dict()
-        
-        # Determine if this is a batch or single event
-        batch_size = 1
-        if event_data.get("eventType") == "batch" and event_data.get("events"):
-            batch_size = len(event_data["events"]) + 1  # +1 for wrapper event
+        event_data = request_data.model_dump()
         
-        # Process events
-        events_to_insert = []
+        # Determine if this is a batch or single event, then process events
+        events_list = event_data.get("events") if event_data.get("eventType") == "batch" else None
+        received_at = datetime.utcnow()
         
-        if event_data.get("eventType") == "batch" and event_data.get("events"):
-            events_to_insert = process_batch_events(event_data, client_ip, user_agent, client_id)
+        if events_list:
+            batch_size = len(events_list) + 1  # +1 for wrapper event
+            events_to_insert = process_batch_events(event_data, client_ip, user_agent, client_id, received_at)
         else:
+            batch_size = 1
             event_timestamp = parse_timestamp(event_data.get("timestamp", ""))
-            event_record = create_event_record(event_data, client_ip, user_agent, event_timestamp, client_id)
-            events_to_insert.append(event_record)
+            events_to_insert = [create_event_record_row(event_data, client_ip, user_agent, event_timestamp, client_id, received_at)]
         
-        # Bulk insert with transaction
-        try:
-            if events_to_insert:
-                db.bulk_insert_mappings(EventLog, events_to_insert)
-                db.commit()
-                logger.info(f"Bulk inserted {len(events_to_insert)} events for client {client_id}")
-        except Exception as db_error:
-            logger.error(f"Database error: {db_error}")
-            db.rollback()
-            return {"status": "accepted", "message": "Processing queued"}
+        # Bulk insert with transaction after the response is sent (pixels only need the status)
+        background_tasks.add_task(persist_events, events_to_insert, client_id)
         
-        # Trigger S3 export for large batches
+        # Queue an S3 export for large batches (background tasks run in order, so after the insert)
         if len(events_to_insert) >= 5:
-            background_tasks.add_task(s3_exporter.export_events, db)
+            background_tasks.add_task(s3_exporter.submit_export)
         
         return {
-            "status": "success", 
+            "status": "accepted", 
             "events_processed": len(events_to_insert),
             "client_id": client_id,
             "batch_size": batch_size
@@ -362,21 +548,32 @@ async def collect_events(
         raise HTTPException(status_code=500, detail="Collection service error")
 
 @app.get("/events/count")
-async def get_event_count(db: Session = Depends(get_db)):
-    """Get total event count"""
+async def get_event_count(estimate: bool = False, conn: Connection = Depends(get_ro_conn)):
+    """Get total event count (exact unless estimate=true)"""
     try:
-        result = db.execute(text("SELECT COUNT(*) FROM events_log"))
-        count = result.scalar()
-        return {"total_events": count, "timestamp": datetime.utcnow().isoformat()}
+        count = None
+        if estimate:
+            # Catalog lookup instead of a full heap scan; -1 until the table is first analyzed
+            count = conn.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'events_log'")
+            ).scalar()
+            if count is not None and count < 0:
+                count = None
+
+        exact = count is None
+        if exact:
+            count = conn.execute(text("SELECT COUNT(*) FROM events_log")).scalar()
+
+        return {"total_events": count, "exact": exact, "timestamp": datetime.utcnow().isoformat()}
     except Exception as e:
         logger.error(f"Failed to get event count: {e}")
         raise HTTPException(status_code=500, detail="Database query failed")
 
 @app.get("/events/recent")
-async def get_recent_events(limit: int = 10, db: Session = Depends(get_db)):
+async def get_recent_events(limit: int = 10, conn: Connection = Depends(get_ro_conn)):
     """Get recent events for debugging"""
     try:
-        result = db.execute(
+        result = conn.execute(
             text("SELECT event_type, site_id, created_at, session_id FROM events_log ORDER BY created_at DESC LIMIT :limit"),
             {"limit": limit}
         )
@@ -402,26 +599,34 @@ async def get_recent_events(limit: int = 10, db: Session = Depends(get_db)):
 s3_exporter = create_s3_exporter()
 
 @app.post("/export/run")
-async def trigger_export(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def trigger_export():
     """Trigger manual S3 export"""
     try:
-        # Run export in background
-        background_tasks.add_task(s3_exporter.export_events, db)
-        return {"message": "Export started", "timestamp": datetime.utcnow().isoformat()}
+        # Run export on the dedicated export worker
+        task_id = s3_exporter.submit_export()
+        return {"message": "Export started", "task_id": task_id, "timestamp": datetime.utcnow().isoformat()}
     except Exception as e:
         logger.error(f"Failed to start export: {e}")
         raise HTTPException(status_code=500, detail="Export failed to start")
 
 @app.get("/export/status")
-async def get_export_status():
+async def get_export_status(conn: Connection = Depends(get_ro_conn)):
     """Get export status"""
     try:
-        status = s3_exporter.get_status()
+        status = s3_exporter.get_export_status(conn)
         return status
     except Exception as e:
         logger.error(f"Failed to get export status: {e}")
         raise HTTPException(status_code=500, detail="Status check failed")
 
+@app.get("/export/status/{task_id}")
+async def get_export_task_status(task_id: str):
+    """Get the state of a submitted export task"""
+    status = s3_exporter.get_job_status(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Export task not found")
+    return status
+
 @app.get("/export/config")
 async def get_export_config():
     """Get export configuration"""
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy import Column, Index, Integer, String, Text, DateTime, JSON, text
 from sqlalchemy.dialects.postgresql import UUID, INET, JSONB
 from sqlalchemy.sql import func
 from .database import Base
@@ -8,7 +8,7 @@ class EventLog(Base):
     __tablename__ = "events_log"
     
     id = Column(Integer, primary_key=True, index=True)
-    event_id = Column(UUID(as_uuid=True), default=uuid.uuid4, nullable=False)
+    event_id = Column(UUID(as_uuid=True), default=uuid.uuid4, server_default=text("gen_random_uuid()"), nullable=False)
     event_type = Column(String(50), nullable=False, index=True)
     session_id = Column(String(100), index=True)
     visitor_id = Column(String(100), index=True)
@@ -20,10 +20,18 @@ class EventLog(Base):
     ip_address = Column(INET)
     raw_event_data = Column(JSONB, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
-    processed_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    processed_at = Column(DateTime(timezone=True), nullable=True)
     client_id = Column(String(255), index=True)
     batch_id = Column(UUID(as_uuid=True), nullable=True, index=True)  # ADDED: For bulk processing
-    export_status = Column(String(20), default='pending', index=True)  # ADDED: For S3 export tracking
+    export_status = Column(String(20), default='pending', server_default='pending')  # ADDED: For S3 export tracking
+    claimed_at = Column(DateTime(timezone=True), nullable=True)  # When an exporter claimed the row (stale claims are retried)
+    
+    __table_args__ = (
+        # Partial indexes: the export queries only ever touch pending rows, which stay a small slice of the table
+        Index("ix_events_pending", "created_at", postgresql_where=text("processed_at IS NULL")),
+        Index("ix_events_exported_at", "processed_at", postgresql_where=text("processed_at IS NOT NULL")),
+        Index("ix_events_export_status", "export_status", postgresql_where=text("export_status = 'pending'")),
+    )
     
     def __repr__(self):
         return f"<EventLog(id={self.id}, event_type='{self.event_type}', session_id='{self.session_id}', client_id='{self.client_id}')>"
\ No newline at end of file
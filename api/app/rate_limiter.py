@@ -1,25 +1,59 @@
 # Create new file: api/app/rate_limiter.py
 
+import os
 import time
 import threading
 from collections import defaultdict, deque
-from typing import Dict, Deque, Tuple
+from functools import lru_cache
+from typing import Any, Dict, Deque, List, Tuple
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
+import redis.asyncio as redis
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Request history is striped across shards (power of two) so concurrent IPs don't share a lock
+RATE_LIMIT_SHARDS = 64
+# Seconds for the background sweeper to visit every shard once
+CLEANUP_CYCLE_SECONDS = 60
+
+# Marker key for trie nodes that complete a configured prefix (never a single path character)
+RULE_KEY = ""
+RULE_CACHE_SIZE = 4096
+
+# Shared rate limit state for multi-worker deployments; in-process state is used when unset
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Sliding one-minute window checked atomically: evict, count, then record the request
+# KEYS[1] = rl:{ip}:{prefix}, ARGV = now, limit, path
+SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - 60)
+local count = redis.call('ZCARD', KEYS[1])
+if count >= tonumber(ARGV[2]) then
+    return {1, redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')[2]}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[1] .. ':' .. ARGV[3])
+redis.call('EXPIRE', KEYS[1], 60)
+return {0, 0}
+"""
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
-    """In-memory rate limiting middleware"""
+    """Sliding-window rate limiting middleware (Redis-backed when REDIS_URL is set, in-memory otherwise)"""
     
     def __init__(self, app):
         super().__init__(app)
-        # IP -> deque of (timestamp, endpoint) tuples
-        self.request_history: Dict[str, Deque[Tuple[float, str]]] = defaultdict(deque)
-        self.lock = threading.Lock()
-        self.last_cleanup = time.time()
+        # Redis-backed sliding window when configured, so limits hold across workers and restarts
+        self.redis = redis.from_url(REDIS_URL) if REDIS_URL else None
+        self.sliding_window = self.redis.register_script(SLIDING_WINDOW_LUA) if self.redis else None
+        
+        # Per shard: window key (see window_key) -> deque of request timestamps, guarded by that shard's lock
+        self.stripes = [threading.Lock() for _ in range(RATE_LIMIT_SHARDS)]
+        self.histories: List[Dict[str, Deque[float]]] = [
+            defaultdict(deque) for _ in range(RATE_LIMIT_SHARDS)
+        ]
         
         # Rate limits (requests per minute)
         self.limits = {
@@ -27,85 +61,155 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             "/api/v1/config/": 60, 
             "/pixel/": 100
         }
+        
+        # Prefix trie over self.limits; a node's RULE_KEY entry holds the (prefix, limit) ending there
+        self.limit_trie: Dict[str, Any] = {}
+        for prefix, limit in self.limits.items():
+            node = self.limit_trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[RULE_KEY] = (prefix, limit)
+        
+        # Traffic concentrates on a handful of paths, so memoize the lookup per path
+        self.get_rate_limit_rule = lru_cache(maxsize=RULE_CACHE_SIZE)(self._match_rate_limit_rule)
+        
+        # Expired entries are swept off the request path, one shard per tick
+        if self.redis is None:
+            self._cleanup_thread = threading.Thread(
+                target=self._cleanup_loop, name="rate-limit-cleanup", daemon=True
+            )
+            self._cleanup_thread.start()
     
     def get_client_ip(self, request: Request) -> str:
         """Extract client IP from request"""
+        # Single pass over the raw ASGI headers for both proxy headers; the first of any repeated header wins
+        forwarded_for = None
+        real_ip = None
+        for name, value in request.scope["headers"]:
+            if name == b"x-forwarded-for":
+                if forwarded_for is None:
+                    forwarded_for = value
+            elif name == b"x-real-ip":
+                if real_ip is None:
+                    real_ip = value
+        
         # Check for forwarded IP first (load balancer/proxy)
-        forwarded_for = request.headers.get("x-forwarded-for")
         if forwarded_for:
-            return forwarded_for.split(',')[0].strip()
+            return forwarded_for.decode("latin-1").partition(",")[0].strip()
         
-        real_ip = request.headers.get("x-real-ip")
         if real_ip:
-            return real_ip
+            return real_ip.decode("latin-1")
             
         return request.client.host
     
+    def window_key(self, ip: str, prefix: str) -> str:
+        """Sliding window key, one window per IP and matched prefix (same shape in memory and Redis)"""
+        return f"rl:{ip}:{prefix}"
+    
+    def _match_rate_limit_rule(self, path: str) -> Tuple[str, int]:
+        """Get the longest matching prefix and its rate limit for path, limit 0 for unlimited"""
+        rule = ("", 0)  # No limit
+        node = self.limit_trie
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            rule = node.get(RULE_KEY, rule)
+        return rule
+    
     def get_rate_limit(self, path: str) -> int:
         """Get rate limit for path, return 0 for unlimited"""
-        for prefix, limit in self.limits.items():
-            if path.startswith(prefix):
-                return limit
-        return 0  # No limit
+        return self.get_rate_limit_rule(path)[1]
     
-    def cleanup_expired(self, current_time: float):
-        """Remove entries older than 1 minute"""
+    def cleanup_expired(self, shard: int, current_time: float):
+        """Remove entries older than 1 minute from one shard"""
         cutoff = current_time - 60  # 1 minute ago
         
-        for ip in list(self.request_history.keys()):
-            history = self.request_history[ip]
-            
-            # Remove old entries
-            while history and history[0][0] < cutoff:
-                history.popleft()
+        with self.stripes[shard]:
+            request_history = self.histories[shard]
+            for key in list(request_history.keys()):
+                history = request_history[key]
                 
-            # Remove empty deques
-            if not history:
-                del self.request_history[ip]
+                # Remove old entries
+                while history and history[0] < cutoff:
+                    history.popleft()
+                    
+                # Remove empty deques
+                if not history:
+                    del request_history[key]
+    
+    def _cleanup_loop(self):
+        """Sweep the shards round-robin so the full ring is visited once per cycle"""
+        interval = CLEANUP_CYCLE_SECONDS / RATE_LIMIT_SHARDS
+        shard = 0
+        while True:
+            time.sleep(interval)
+            try:
+                self.cleanup_expired(shard, time.monotonic())
+            except Exception as e:
+                logger.error(f"Rate limit cleanup failed: {e}")
+            shard = (shard + 1) & (RATE_LIMIT_SHARDS - 1)
     
     def is_rate_limited(self, ip: str, path: str, current_time: float) -> Tuple[bool, int]:
         """Check if IP is rate limited for this path"""
-        limit = self.get_rate_limit(path)
+        prefix, limit = self.get_rate_limit_rule(path)
         if limit == 0:  # No limit
             return False, 0
-            
-        with self.lock:
-            # Cleanup every 5 minutes
-            if current_time - self.last_cleanup > 300:
-                self.cleanup_expired(current_time)
-                self.last_cleanup = current_time
-            
-            history = self.request_history[ip]
+        
+        key = self.window_key(ip, prefix)
+        shard = hash(key) & (RATE_LIMIT_SHARDS - 1)
+        with self.stripes[shard]:
+            history = self.histories[shard][key]
             cutoff = current_time - 60  # Last minute
             
-            # Count requests in last minute for this endpoint category
-            count = sum(1 for timestamp, _ in history if timestamp >= cutoff)
+            # Evict expired entries; whatever remains is inside the window
+            while history and history[0] < cutoff:
+                history.popleft()
             
-            if count >= limit:
-                # Calculate retry after (seconds until oldest request expires)
-                if history:
-                    oldest_timestamp = min(timestamp for timestamp, _ in history if timestamp >= cutoff)
-                    retry_after = int(60 - (current_time - oldest_timestamp)) + 1
-                else:
-                    retry_after = 60
+            if len(history) >= limit:
+                # Retry once the oldest request in the window expires
+                retry_after = int(60 - (current_time - history[0])) + 1
                 return True, retry_after
             
             # Add this request
-            history.append((current_time, path))
+            history.append(current_time)
             return False, 0
     
+    async def is_rate_limited_redis(self, ip: str, path: str, current_time: float) -> Tuple[bool, int]:
+        """Check if IP is rate limited for this path against the shared Redis window"""
+        prefix, limit = self.get_rate_limit_rule(path)
+        if limit == 0:  # No limit
+            return False, 0
+        
+        try:
+            limited, oldest_timestamp = await self.sliding_window(
+                keys=[self.window_key(ip, prefix)], args=[current_time, limit, path]
+            )
+        except Exception as e:
+            # Fail open rather than rejecting traffic while Redis is unavailable
+            logger.error(f"Redis rate limit check failed: {e}")
+            return False, 0
+        
+        if limited:
+            retry_after = int(60 - (current_time - float(oldest_timestamp))) + 1
+            return True, retry_after
+        return False, 0
+    
     async def dispatch(self, request: Request, call_next):
         """Rate limit check"""
-        ip = self.get_client_ip(request)
-        path = request.url.path
-        current_time = time.time()
+        path = request.scope["path"]
         
-        # Skip rate limiting for health checks
-        if path == "/health":
+        # Skip rate limiting for health checks and unlimited paths before touching headers
+        if path == "/health" or self.get_rate_limit(path) == 0:
             return await call_next(request)
         
-        # Check rate limit
-        is_limited, retry_after = self.is_rate_limited(ip, path, current_time)
+        ip = self.get_client_ip(request)
+        
+        # Check rate limit (the shared Redis window needs wall-clock time comparable across workers)
+        if self.redis is not None:
+            is_limited, retry_after = await self.is_rate_limited_redis(ip, path, time.time())
+        else:
+            is_limited, retry_after = self.is_rate_limited(ip, path, time.monotonic())
         
         if is_limited:
             logger.warning(f"Rate limit exceeded for IP {ip} on {path}")
@@ -115,4 +219,4 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
                 headers={"Retry-After": str(retry_after)}
             )
         
-        return await call_next(request)
\ No newline at end of file
+        return await call_next(request)
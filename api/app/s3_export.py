@@ -1,19 +1,132 @@
+import gzip
+import io
 import os
-import json
 import logging
-from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
-from io import StringIO, BytesIO
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import quote
 import polars as pl
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError, NoCredentialsError
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, cast, func, or_, select, text, update, String, Text
+from sqlalchemy.engine import Connection, Result
 
+from .database import SessionLocal
 from .models import EventLog
 
 logger = logging.getLogger(__name__)
 
+# Rows fetched per round-trip from the server-side export cursor
+EXPORT_FETCH_SIZE = 500
+
+# ISO-8601 in UTC with microseconds, formatted by Postgres (to_char on timestamptz AT TIME ZONE 'UTC')
+ISO_TO_CHAR_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'
+
+def iso_utc(column, name: str):
+    """Select a timestamptz column as an ISO-8601 UTC string"""
+    return func.to_char(func.timezone("UTC", column), ISO_TO_CHAR_FORMAT).label(name)
+
+# Exported columns, fetched as plain tuples. Everything but id arrives as text formatted by
+# Postgres, so no UUID, datetime or decoded JSON objects are built per row in Python
+EXPORT_COLUMNS = (
+    EventLog.id,
+    cast(EventLog.event_id, String).label("event_id"),
+    EventLog.event_type,
+    EventLog.session_id,
+    EventLog.visitor_id,
+    EventLog.site_id,
+    iso_utc(EventLog.timestamp, "timestamp"),
+    EventLog.url,
+    EventLog.path,
+    EventLog.user_agent,
+    func.host(EventLog.ip_address).label("ip_address"),
+    iso_utc(EventLog.created_at, "created_at"),
+    cast(EventLog.raw_event_data, Text).label("raw_event_data"),
+    EventLog.client_id,
+)
+
+# Polars schema matching EXPORT_COLUMNS
+EXPORT_SCHEMA = {
+    "id": pl.Int64,
+    "event_id": pl.Utf8,
+    "event_type": pl.Utf8,
+    "session_id": pl.Utf8,
+    "visitor_id": pl.Utf8,
+    "site_id": pl.Utf8,
+    "timestamp": pl.Utf8,
+    "url": pl.Utf8,
+    "path": pl.Utf8,
+    "user_agent": pl.Utf8,
+    "ip_address": pl.Utf8,
+    "created_at": pl.Utf8,
+    "raw_event_data": pl.Utf8,
+    "client_id": pl.Utf8,
+}
+
+# Objects are written one per (client_id, site_id, event hour) under Hive-style partition prefixes.
+# The event hour is a temporary "YYYY-MM-DDTHH" column cut from the UTC ISO timestamp
+EVENT_HOUR_COLUMN = "__event_hour"
+EXPORT_PARTITION_COLUMNS = ["client_id", "site_id", EVENT_HOUR_COLUMN]
+# Partition value used for rows without a client_id / site_id
+UNKNOWN_PARTITION_VALUE = "unknown"
+
+# Text formats are gzipped before upload (level 1: most of the size win for a fraction of the CPU);
+# Parquet is already compressed internally
+GZIP_EXPORT_FORMATS = ("json", "csv")
+EXPORT_GZIP_LEVEL = 1
+
+# Parquet encoding: zstd level 3 is a good size/CPU trade-off (override with PARQUET_ZSTD_LEVEL);
+# statistics enable row-group pruning
+PARQUET_ZSTD_LEVEL = 3
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+# Marks exported rows in one statement per chunk; export_status is kept in step with processed_at
+MARK_EXPORTED_SQL = text(
+    "UPDATE events_log SET processed_at = :t, export_status = 'exported' WHERE id = ANY(:ids)"
+)
+MARK_EXPORTED_CHUNK_SIZE = 5000
+
+# Failed exports hand their claimed rows back for the next run
+RELEASE_CLAIMED_SQL = text(
+    "UPDATE events_log SET export_status = 'pending', batch_id = NULL, claimed_at = NULL WHERE batch_id = :batch_id"
+)
+
+# Claims older than this were left behind by an exporter that died mid-export and are claimed again
+EXPORT_CLAIM_TIMEOUT = timedelta(minutes=30)
+
+TOTAL_EVENTS_ESTIMATE_SQL = text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'events_log'")
+
+# Finished export jobs kept for /export/status/{task_id} lookups
+EXPORT_JOB_HISTORY = 100
+
+# Rows per part file; parts are serialized once in memory and uploaded concurrently
+EXPORT_PART_ROWS = 50_000
+EXPORT_UPLOAD_WORKERS = 8
+
+# Pool sized well above the multipart concurrency; keepalive and adaptive retries for long uploads
+S3_CLIENT_CONFIG = BotoConfig(
+    max_pool_connections=64,
+    retries={"mode": "adaptive", "max_attempts": 10},
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=30
+)
+
+# Multipart upload tuning: 6 MiB parts (just above the S3 5 MiB minimum), up to 8 uploaded concurrently
+EXPORT_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=6 * 1024 * 1024,
+    multipart_chunksize=6 * 1024 * 1024,
+    max_concurrency=8
+)
+
 class S3ExportConfig:
     """Configuration for S3 export operations"""
     
@@ -31,8 +144,9 @@ class S3ExportConfig:
         self.backup_region = os.getenv("BACKUP_S3_REGION", "us-east-1")
         
         # Export configuration
-        self.export_format = os.getenv("EXPORT_FORMAT", "json").lower()
+        self.export_format = os.getenv("EXPORT_FORMAT", "parquet").lower()
         self.export_schedule = os.getenv("EXPORT_SCHEDULE", "hourly")
+        self.parquet_zstd_level = int(os.getenv("PARQUET_ZSTD_LEVEL", str(PARQUET_ZSTD_LEVEL)))
         self.site_id = os.getenv("SITE_ID", "default")
         
         # Validation
@@ -48,37 +162,37 @@ class S3ExportConfig:
         if self.export_format not in ["json", "csv", "parquet"]:
             errors.append(f"Invalid EXPORT_FORMAT: {self.export_format}")
         
+        if not 1 <= self.parquet_zstd_level <= 22:
+            errors.append(f"Invalid PARQUET_ZSTD_LEVEL: {self.parquet_zstd_level}")
+        
         if errors:
             raise ValueError(f"S3 Export configuration errors: {', '.join(errors)}")
     
     def get_client_s3_client(self):
         """Get S3 client for client bucket"""
-        if self.client_access_key and self.client_secret_key:
-            return boto3.client(
-                's3',
-                aws_access_key_id=self.client_access_key,
-                aws_secret_access_key=self.client_secret_key,
-                region_name=self.client_region
-            )
-        else:
-            # Use default credentials (IAM role, profile, etc.)
-            return boto3.client('s3', region_name=self.client_region)
+        # Falls back to default credentials (IAM role, profile, etc.) when no keys are set
+        return get_s3_client(self.client_region, self.client_access_key, self.client_secret_key)
     
     def get_backup_s3_client(self):
         """Get S3 client for backup bucket"""
         if not self.backup_bucket:
             return None
-            
-        if self.backup_access_key and self.backup_secret_key:
-            return boto3.client(
-                's3',
-                aws_access_key_id=self.backup_access_key,
-                aws_secret_access_key=self.backup_secret_key,
-                region_name=self.backup_region
-            )
-        else:
-            # Use default credentials
-            return boto3.client('s3', region_name=self.backup_region)
+        
+        # Use default credentials unless backup keys are configured
+        return get_s3_client(self.backup_region, self.backup_access_key, self.backup_secret_key)
+
+@lru_cache(maxsize=None)
+def get_s3_client(region: str, access_key: Optional[str] = None, secret_key: Optional[str] = None):
+    """Shared S3 client per region/credentials, so its connection pool is reused across exporters"""
+    if access_key and secret_key:
+        return boto3.client(
+            's3',
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+            config=S3_CLIENT_CONFIG
+        )
+    return boto3.client('s3', region_name=region, config=S3_CLIENT_CONFIG)
 
 class S3Exporter:
     """Main S3 export functionality"""
@@ -87,51 +201,107 @@ class S3Exporter:
         self.config = config
         self.client_s3 = config.get_client_s3_client()
         self.backup_s3 = config.get_backup_s3_client()
+        
+        # Exports run on a dedicated worker thread, off the threadpool that serves requests
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="s3-export")
+        self._jobs: "OrderedDict[str, Future]" = OrderedDict()
+        self._queued_job_id: Optional[str] = None
+        self._jobs_lock = threading.Lock()
+    
+    def submit_export(self, since: Optional[datetime] = None, limit: int = 10000) -> str:
+        """Queue an export on the export worker and return its job id
+        
+        A job that is queued but not yet started already covers any newly written
+        events, so repeated triggers coalesce into it instead of piling up.
+        """
+        with self._jobs_lock:
+            queued = self._jobs.get(self._queued_job_id) if self._queued_job_id else None
+            if queued is not None and not queued.running() and not queued.done():
+                return self._queued_job_id
+            
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = self._executor.submit(self._run_export_job, since, limit)
+            self._queued_job_id = job_id
+            
+            # Keep a bounded history of finished jobs for status lookups
+            while len(self._jobs) > EXPORT_JOB_HISTORY:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if not oldest.done():
+                    break
+                del self._jobs[oldest_id]
+            
+            return job_id
+    
+    def _run_export_job(self, since: Optional[datetime], limit: int) -> Dict[str, Any]:
+        """Run one export with its own session (executes on the export worker)"""
+        with SessionLocal() as db:
+            return self.export_events(db, since, limit)
+    
+    def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the state (and result once finished) of a submitted export job"""
+        future = self._jobs.get(job_id)
+        if future is None:
+            return None
+        
+        if future.done():
+            # export_events reports its own failures; anything raised past it marks the job failed
+            error = future.exception()
+            if error is not None:
+                return {"task_id": job_id, "state": "failed", "error": str(error)}
+            return {"task_id": job_id, "state": "finished", "result": future.result()}
+        state = "running" if future.running() else "queued"
+        return {"task_id": job_id, "state": state}
     
     def export_events(self, db: Session, since: Optional[datetime] = None, limit: int = 10000) -> Dict[str, Any]:
         """Export events to S3 buckets"""
+        # One clock read per export, shared by the export id and processed_at
+        now = datetime.now(timezone.utc)
+        export_time = now.isoformat()
+        batch_id = None
         try:
-            # Get events to export
-            events = self._get_events_for_export(db, since, limit)
+            # Reserve a batch of pending events so concurrent exporters never pick the same rows
+            batch_id = self._claim_events_for_export(db, since, limit)
             
-            if not events:
+            # Stream the claimed events and build the export records in one pass
+            events = self._get_events_for_export(db, batch_id)
+            export_data, event_ids = self._prepare_export_data(events, now, batch_id)
+            
+            if not event_ids:
                 return {
                     "status": "success",
                     "message": "No events to export",
                     "events_exported": 0,
-                    "export_time": datetime.now(timezone.utc).isoformat()
+                    "export_time": export_time
                 }
             
-            # Generate export data
-            export_data = self._prepare_export_data(events)
-            
-            # Export to client bucket
-            client_upload_result = self._upload_to_s3(
-                self.client_s3,
-                self.config.client_bucket,
-                export_data,
-                "client"
-            )
-            
-            # Export to backup bucket (if configured)
-            backup_upload_result = None
+            # Serialize once and upload to the client bucket and, if configured, the backup bucket
+            targets = [(self.client_s3, self.config.client_bucket, "client")]
             if self.backup_s3 and self.config.backup_bucket:
-                backup_upload_result = self._upload_to_s3(
-                    self.backup_s3,
-                    self.config.backup_bucket,
-                    export_data,
-                    "backup"
-                )
+                targets.append((self.backup_s3, self.config.backup_bucket, "backup"))
+            upload_results = self._upload_to_s3(targets, export_data)
+            client_upload_result = upload_results["client"]
+            backup_upload_result = upload_results.get("backup")
+            
+            if not client_upload_result["success"]:
+                # Hand the batch back so the next export retries it
+                self._release_claimed_events(db, batch_id)
+                return {
+                    "status": "error",
+                    "message": f"Client upload failed: {client_upload_result['error']}",
+                    "events_exported": 0,
+                    "export_time": export_time,
+                    "client_upload": client_upload_result,
+                    "backup_upload": backup_upload_result
+                }
             
             # Update exported_at timestamps
-            event_ids = [event.id for event in events]
-            self._mark_events_exported(db, event_ids)
+            self._mark_events_exported(db, event_ids, now)
             
             return {
                 "status": "success",
-                "message": f"Exported {len(events)} events successfully",
-                "events_exported": len(events),
-                "export_time": datetime.now(timezone.utc).isoformat(),
+                "message": f"Exported {len(event_ids)} events successfully",
+                "events_exported": len(event_ids),
+                "export_time": export_time,
                 "client_upload": client_upload_result,
                 "backup_upload": backup_upload_result,
                 "format": self.config.export_format
@@ -139,141 +309,285 @@ class S3Exporter:
             
         except Exception as e:
             logger.error(f"Export failed: {str(e)}")
+            if batch_id is not None:
+                self._release_claimed_events(db, batch_id)
             return {
                 "status": "error",
                 "message": f"Export failed: {str(e)}",
                 "events_exported": 0,
-                "export_time": datetime.now(timezone.utc).isoformat()
+                "export_time": export_time
             }
     
-    def _get_events_for_export(self, db: Session, since: Optional[datetime], limit: int) -> List[EventLog]:
-        """Get events that need to be exported"""
-        query = db.query(EventLog).filter(EventLog.processed_at.is_(None))
+    def _claim_events_for_export(self, db: Session, since: Optional[datetime], limit: int) -> uuid.UUID:
+        """Reserve up to limit pending events under a new batch id and commit the reservation
+        
+        FOR UPDATE SKIP LOCKED lets concurrent exporters claim disjoint batches without waiting on each other.
+        Rows stuck in_progress past EXPORT_CLAIM_TIMEOUT (the claiming process died) are claimable again.
+        """
+        batch_id = uuid.uuid4()
+        stale_claim = and_(
+            EventLog.export_status == "in_progress",
+            # claimed_at is NULL on rows claimed before the column existed
+            or_(EventLog.claimed_at.is_(None), EventLog.claimed_at < func.now() - EXPORT_CLAIM_TIMEOUT)
+        )
+        claimable = select(EventLog.id).where(
+            EventLog.processed_at.is_(None),
+            or_(EventLog.export_status == "pending", stale_claim)
+        )
         
         if since:
-            query = query.filter(EventLog.created_at >= since)
+            claimable = claimable.where(EventLog.created_at >= since)
+        
+        # Oldest first, matching the ix_events_pending partial index
+        claimable = claimable.order_by(EventLog.created_at).limit(limit).with_for_update(skip_locked=True)
+        
+        db.execute(
+            update(EventLog.__table__)
+            .where(EventLog.id.in_(claimable.scalar_subquery()))
+            .values(export_status="in_progress", batch_id=batch_id, claimed_at=func.now())
+        )
+        db.commit()
+        return batch_id
+    
+    def _get_events_for_export(self, db: Session, batch_id: uuid.UUID) -> Result:
+        """Stream the events claimed under batch_id as Core row tuples"""
+        query = select(*EXPORT_COLUMNS).where(EventLog.batch_id == batch_id)
         
         # Order by created_at for consistent export order
         query = query.order_by(EventLog.created_at)
         
-        return query.limit(limit).all()
+        # Server-side cursor: rows are fetched EXPORT_FETCH_SIZE at a time instead of all at once
+        return db.execute(query.execution_options(stream_results=True, yield_per=EXPORT_FETCH_SIZE))
+    
+    def _release_claimed_events(self, db: Session, batch_id: uuid.UUID):
+        """Return a claimed batch to pending after a failed export"""
+        try:
+            db.rollback()
+            db.execute(RELEASE_CLAIMED_SQL, {"batch_id": batch_id})
+            db.commit()
+            logger.info(f"Released export batch {batch_id} back to pending")
+        except Exception as e:
+            logger.error(f"Failed to release export batch {batch_id}: {str(e)}")
+            db.rollback()
     
-    def _prepare_export_data(self, events: List[EventLog]) -> Dict[str, Any]:
-        """Prepare event data for export"""
+    def _prepare_export_data(self, rows: Result, now: datetime, batch_id: uuid.UUID) -> Tuple[Dict[str, Any], List[int]]:
+        """Prepare event data for export as a Polars DataFrame, consuming the row stream once
+        
+        Returns the export payload and the ids of the exported events.
+        """
+        # Each fetched partition is transposed into columns and becomes one DataFrame chunk;
+        # no per-row dicts are built
+        chunks = [
+            pl.DataFrame(list(zip(*partition)), schema=EXPORT_SCHEMA, orient="col")
+            for partition in rows.partitions()
+        ]
+        df = pl.concat(chunks) if chunks else pl.DataFrame(schema=EXPORT_SCHEMA)
+        
         export_metadata = {
-            "export_id": f"export_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}",
-            "export_time": datetime.now(timezone.utc).isoformat(),
-            "event_count": len(events),
+            # The claim's batch id keeps object keys unique across exports started in the same second
+            "export_id": f"export_{now.strftime('%Y%m%d_%H%M%S')}_{batch_id.hex}",
+            "export_time": now.isoformat(),
+            "event_count": df.height,
             "format": self.config.export_format,
             "site_id": self.config.site_id
         }
         
-        if events:
+        if df.height:
             export_metadata["time_range"] = {
-                "start": events[0].created_at.isoformat(),
-                "end": events[-1].created_at.isoformat()
+                "start": df["created_at"].min(),
+                "end": df["created_at"].max()
             }
         
-        # Convert events to serializable format
-        event_records = []
-        for event in events:
-            record = {
-                "id": event.id,
-                "event_id": str(event.event_id),
-                "event_type": event.event_type,
-                "session_id": event.session_id,
-                "visitor_id": event.visitor_id,
-                "site_id": event.site_id,
-                "timestamp": event.timestamp.isoformat(),
-                "url": event.url,
-                "path": event.path,
-                "user_agent": event.user_agent,
-                "ip_address": str(event.ip_address) if event.ip_address else None,
-                "created_at": event.created_at.isoformat(),
-                "raw_event_data": event.raw_event_data
-            }
-            event_records.append(record)
+        event_ids = df["id"].to_list()
         
         return {
             "export_metadata": export_metadata,
-            "events": event_records
-        }
+            "events": df
+        }, event_ids
     
-    def _upload_to_s3(self, s3_client, bucket: str, export_data: Dict[str, Any], upload_type: str) -> Dict[str, Any]:
-        """Upload export data to S3 bucket"""
-        try:
-            # Generate S3 key
-            timestamp = datetime.now(timezone.utc)
-            key = f"analytics/{timestamp.year}/{timestamp.month:02d}/{timestamp.day:02d}/{export_data['export_metadata']['export_id']}.{self.config.export_format}"
-            
-            # Prepare data based on format
-            if self.config.export_format == "json":
-                content = json.dumps(export_data, indent=2, default=str)
-                content_type = "application/json"
+    def _upload_to_s3(self, targets: List[Tuple[Any, str, str]], export_data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Upload export data as part files per client/site partition to each (s3_client, bucket, upload_type) target
+        
+        Every part is serialized once and the same bytes are uploaded to all targets concurrently.
+        Returns the upload result per upload_type.
+        """
+        objects: Dict[str, List[Dict[str, Any]]] = {upload_type: [] for _, _, upload_type in targets}
+        errors: Dict[str, List[Exception]] = {upload_type: [] for _, _, upload_type in targets}
+        
+        with ThreadPoolExecutor(max_workers=EXPORT_UPLOAD_WORKERS, thread_name_prefix="s3-upload") as executor:
+            upload_futures = {}
+            try:
+                export_metadata = export_data['export_metadata']
+                # Partition by event time, not upload time, so late-arriving events land in their own hour
+                partitions = export_data['events'].with_columns(
+                    pl.col("timestamp").str.slice(0, 13).alias(EVENT_HOUR_COLUMN)
+                ).partition_by(EXPORT_PARTITION_COLUMNS, as_dict=True, maintain_order=True)
                 
-            elif self.config.export_format == "csv":
-                # Convert events to CSV using Polars
-                df = pl.DataFrame(export_data['events'])
-                csv_buffer = StringIO()
-                df.write_csv(csv_buffer)
-                content = csv_buffer.getvalue()
-                content_type = "text/csv"
+                extension = self.config.export_format
+                if self.config.export_format in GZIP_EXPORT_FORMATS:
+                    extension += ".gz"
                 
-            elif self.config.export_format == "parquet":
-                # Convert events to Parquet using Polars
-                df = pl.DataFrame(export_data['events'])
-                parquet_buffer = BytesIO()
-                df.write_parquet(parquet_buffer)
-                content = parquet_buffer.getvalue()
-                content_type = "application/octet-stream"
-            
-            # Upload to S3
-            if isinstance(content, str):
-                content = content.encode('utf-8')
+                # Each partition is split into parts of at most EXPORT_PART_ROWS rows
+                serialize_futures = {}
+                for (client_id, site_id, event_hour), events in partitions.items():
+                    prefix = self._partition_prefix(client_id, site_id, event_hour)
+                    events = events.drop(EVENT_HOUR_COLUMN)
+                    for part_number, part in enumerate(events.iter_slices(EXPORT_PART_ROWS)):
+                        key = f"{prefix}{export_metadata['export_id']}-part{part_number:05d}.{extension}"
+                        serialize_futures[executor.submit(self._serialize_part, part)] = (key, part)
+                
+                # Fan each serialized part out to every target as soon as it is ready
+                for future in as_completed(serialize_futures):
+                    key, part = serialize_futures[future]
+                    payload, content_type, content_encoding = future.result()
+                    for s3_client, bucket, upload_type in targets:
+                        metadata = self._object_metadata(export_metadata, part, upload_type)
+                        upload_future = executor.submit(
+                            self._upload_part, s3_client, bucket, key, payload, content_type, content_encoding, metadata
+                        )
+                        upload_futures[upload_future] = (upload_type, part.height)
+            except Exception as e:
+                # Nothing more is scheduled; parts already in flight are collected and cleaned up below
+                for upload_type in errors:
+                    errors[upload_type].append(e)
             
-            s3_client.put_object(
-                Bucket=bucket,
-                Key=key,
-                Body=content,
-                ContentType=content_type,
-                Metadata={
-                    'export_id': export_data['export_metadata']['export_id'],
-                    'event_count': str(export_data['export_metadata']['event_count']),
-                    'export_type': upload_type
-                }
-            )
+            for future in as_completed(upload_futures):
+                upload_type, event_count = upload_futures[future]
+                try:
+                    objects[upload_type].append({**future.result(), "event_count": event_count})
+                except Exception as e:
+                    errors[upload_type].append(e)
+        
+        results = {}
+        for s3_client, bucket, upload_type in targets:
+            if errors[upload_type]:
+                # Don't leave a partial export behind in the bucket
+                self._delete_objects(s3_client, bucket, [obj["key"] for obj in objects[upload_type]])
+                results[upload_type] = self._upload_error(errors[upload_type][0], upload_type)
+                continue
             
-            return {
+            uploaded = sorted(objects[upload_type], key=lambda obj: obj["key"])
+            results[upload_type] = {
                 "success": True,
                 "bucket": bucket,
-                "key": key,
-                "size_bytes": len(content),
-                "upload_type": upload_type
-            }
-            
-        except ClientError as e:
-            logger.error(f"S3 upload failed for {upload_type}: {str(e)}")
-            return {
-                "success": False,
-                "error": str(e),
+                "objects": uploaded,
+                "size_bytes": sum(obj["size_bytes"] for obj in uploaded),
                 "upload_type": upload_type
             }
+        return results
+    
+    def _upload_error(self, error: Exception, upload_type: str) -> Dict[str, Any]:
+        """Log an upload failure and build its result"""
+        if isinstance(error, ClientError):
+            logger.error(f"S3 upload failed for {upload_type}: {str(error)}")
+            message = str(error)
+        else:
+            logger.error(f"Unexpected error during {upload_type} upload: {str(error)}")
+            message = f"Unexpected error: {str(error)}"
+        return {
+            "success": False,
+            "error": message,
+            "upload_type": upload_type
+        }
+    
+    def _serialize_part(self, events: pl.DataFrame) -> Tuple[bytes, str, Optional[str]]:
+        """Serialize one part file to bytes and return them with the content type and encoding (runs on the upload pool)"""
+        buffer = io.BytesIO()
+        content_type = self._write_export_data(events, buffer)
+        
+        if self.config.export_format in GZIP_EXPORT_FORMATS:
+            return gzip.compress(buffer.getvalue(), compresslevel=EXPORT_GZIP_LEVEL), content_type, "gzip"
+        return buffer.getvalue(), content_type, None
+    
+    def _upload_part(self, s3_client, bucket: str, key: str, payload: bytes,
+                     content_type: str, content_encoding: Optional[str], metadata: Dict[str, str]) -> Dict[str, Any]:
+        """Upload one serialized part file (runs on the upload pool)"""
+        extra_args = {
+            'ContentType': content_type,
+            'Metadata': metadata
+        }
+        if content_encoding:
+            extra_args['ContentEncoding'] = content_encoding
+        
+        # Each upload reads its own view of the shared bytes, sent as concurrent multipart parts
+        s3_client.upload_fileobj(
+            Fileobj=io.BytesIO(payload),
+            Bucket=bucket,
+            Key=key,
+            Config=EXPORT_TRANSFER_CONFIG,
+            ExtraArgs=extra_args
+        )
+        return {"key": key, "size_bytes": len(payload)}
+    
+    def _delete_objects(self, s3_client, bucket: str, keys: List[str]):
+        """Best-effort removal of already uploaded part files"""
+        if not keys:
+            return
+        try:
+            s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+            )
         except Exception as e:
-            logger.error(f"Unexpected error during {upload_type} upload: {str(e)}")
-            return {
-                "success": False,
-                "error": f"Unexpected error: {str(e)}",
-                "upload_type": upload_type
-            }
+            logger.error(f"Failed to clean up partial export in {bucket}: {str(e)}")
+    
+    def _partition_prefix(self, client_id: Optional[str], site_id: Optional[str], event_hour: str) -> str:
+        """Hive-style S3 prefix so query engines (Athena/Presto) can prune by tenant and event time"""
+        client_part = quote(client_id or UNKNOWN_PARTITION_VALUE, safe="")
+        site_part = quote(site_id or UNKNOWN_PARTITION_VALUE, safe="")
+        # event_hour is "YYYY-MM-DDTHH"
+        return (
+            f"analytics/client_id={client_part}/site_id={site_part}/"
+            f"year={event_hour[0:4]}/month={event_hour[5:7]}/day={event_hour[8:10]}/hour={event_hour[11:13]}/"
+        )
+    
+    def _object_metadata(self, export_metadata: Dict[str, Any], events: pl.DataFrame, upload_type: str) -> Dict[str, str]:
+        """S3 user metadata describing one partition object of an export"""
+        metadata = {
+            'export_id': export_metadata['export_id'],
+            'event_count': str(events.height),
+            'export_type': upload_type
+        }
+        if events.height:
+            # created_at is already ISO-8601 in UTC, so string order is time order
+            metadata['time_range_start'] = events['created_at'].min()
+            metadata['time_range_end'] = events['created_at'].max()
+        return metadata
+    
+    def _write_export_data(self, df: pl.DataFrame, buffer) -> str:
+        """Serialize an export DataFrame into a binary file object and return its content type"""
+        if self.config.export_format == "json":
+            # Newline-delimited JSON, one event per line; export metadata travels as S3 object metadata
+            df.write_ndjson(buffer)
+            return "application/x-ndjson"
+        
+        elif self.config.export_format == "csv":
+            df.write_csv(buffer)
+            return "text/csv"
+        
+        elif self.config.export_format == "parquet":
+            # Columnar + dictionary-encoded repetitive columns (event_type, site_id, path); raw_event_data
+            # is already a JSON text column, so it compresses well under page-level zstd as is
+            df.write_parquet(
+                buffer,
+                compression="zstd",
+                compression_level=self.config.parquet_zstd_level,
+                statistics=True,
+                row_group_size=PARQUET_ROW_GROUP_SIZE
+            )
+            return "application/octet-stream"
+        
+        raise ValueError(f"Unsupported export format: {self.config.export_format}")
     
-    def _mark_events_exported(self, db: Session, event_ids: List[int]):
+    def _mark_events_exported(self, db: Session, event_ids: List[int], export_time: datetime):
         """Mark events as exported"""
         try:
-            export_time = datetime.now(timezone.utc)
-            db.query(EventLog).filter(EventLog.id.in_(event_ids)).update(
-                {"processed_at": export_time},
-                synchronize_session=False
-            )
+            # Bind ids as a single array parameter instead of an IN list of N literals
+            for start in range(0, len(event_ids), MARK_EXPORTED_CHUNK_SIZE):
+                db.execute(MARK_EXPORTED_SQL, {
+                    "t": export_time,
+                    "ids": event_ids[start:start + MARK_EXPORTED_CHUNK_SIZE]
+                })
             db.commit()
             logger.info(f"Marked {len(event_ids)} events as exported")
         except Exception as e:
@@ -281,24 +595,28 @@ class S3Exporter:
             db.rollback()
             raise
     
-    def get_export_status(self, db: Session) -> Dict[str, Any]:
+    def get_export_status(self, conn: Connection) -> Dict[str, Any]:
         """Get export pipeline status"""
         try:
-            # Count events by status
-            total_events = db.query(EventLog).count()
-            exported_events = db.query(EventLog).filter(EventLog.processed_at.isnot(None)).count()
-            pending_events = total_events - exported_events
+            # Catalog estimate for the table total; -1 until the table is first analyzed
+            total_events = conn.execute(TOTAL_EVENTS_ESTIMATE_SQL).scalar()
+            if total_events is None or total_events < 0:
+                total_events = conn.execute(select(func.count()).select_from(EventLog)).scalar()
+            
+            # Pending rows are counted exactly off the small ix_events_pending partial index
+            pending_events = conn.execute(
+                select(func.count()).select_from(EventLog).where(EventLog.processed_at.is_(None))
+            ).scalar()
+            exported_events = max(total_events - pending_events, 0)
             
-            # Get latest export
-            latest_exported = db.query(EventLog).filter(
-                EventLog.processed_at.isnot(None)
-            ).order_by(EventLog.processed_at.desc()).first()
+            # Latest export is a backward seek on ix_events_exported_at
+            latest_export = conn.execute(select(func.max(EventLog.processed_at))).scalar()
             
             return {
                 "total_events": total_events,
                 "exported_events": exported_events,
                 "pending_events": pending_events,
-                "latest_export": latest_exported.processed_at.isoformat() if latest_exported else None,
+                "latest_export": latest_export.isoformat() if latest_export else None,
                 "export_format": self.config.export_format,
                 "client_bucket": self.config.client_bucket,
                 "backup_bucket": self.config.backup_bucket,
@@ -7,12 +7,15 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Shared with /collect, which re-checks the bytes it reads when no Content-Length was sent
+MAX_REQUEST_SIZE = 1024 * 1024  # 1MB
+
 class RequestValidationMiddleware(BaseHTTPMiddleware):
     """Middleware for request size and content-type validation"""
     
     def __init__(self, app):
         super().__init__(app)
-        self.max_request_size = 1024 * 1024  # 1MB
+        self.max_request_size = MAX_REQUEST_SIZE
         self.protected_endpoints = ['/collect']
     
     async def dispatch(self, request: Request, call_next):
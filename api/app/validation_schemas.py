@@ -1,23 +1,21 @@
 # Create new file: api/app/validation_schemas.py
 
-from pydantic import BaseModel, validator, Field
+from pydantic import BaseModel, field_validator, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 import json
 
-class EventData(BaseModel):
-    """Individual event data with size limits"""
-    class Config:
-        # Pydantic v2 fix: renamed from max_anystr_length
-        str_max_length = 10000
-        
-    # Allow any additional fields but validate size
-    def __init__(self, **data):
-        # Convert to JSON and check size
-        json_str = json.dumps(data)
-        if len(json_str.encode('utf-8')) > 10000:
-            raise ValueError("Individual event exceeds 10KB limit")
-        super().__init__(**data)
+def json_size(value: Any) -> int:
+    """Length of value serialized by json.dumps with its defaults (the size the 10KB limits are defined in)
+    
+    ensure_ascii counts each non-ASCII character as its \\uXXXX escape, so the limit keeps the same
+    meaning for non-ASCII payloads; a compact UTF-8 measure would admit up to ~3x more bytes.
+    """
+    try:
+        return len(json.dumps(value))
+    except (TypeError, ValueError) as e:
+        # Surface as a validation error rather than a 500
+        raise ValueError(f"Value is not JSON serializable: {e}")
 
 class IndividualEvent(BaseModel):
     """Single event within a batch"""
@@ -25,19 +23,20 @@ class IndividualEvent(BaseModel):
     timestamp: Optional[str] = Field(None, max_length=50)
     eventData: Optional[Dict[str, Any]] = None
     
-    @validator('eventType')
+    @field_validator('eventType')
+    @classmethod
     def validate_event_type(cls, v):
         if not v or not v.strip():
             raise ValueError('eventType cannot be empty')
         return v.strip()
     
-    @validator('eventData')
+    @field_validator('eventData')
+    @classmethod
     def validate_event_data_size(cls, v):
         if v is None:
             return v
         # Check serialized size
-        json_str = json.dumps(v)
-        if len(json_str.encode('utf-8')) > 10000:
+        if json_size(v) > 10000:
             raise ValueError('eventData exceeds 10KB limit')
         return v
 
@@ -51,31 +50,26 @@ class CollectionRequest(BaseModel):
     url: Optional[str] = Field(None, max_length=2000)
     path: Optional[str] = Field(None, max_length=1000)
     
-    # Batch event handling
-    events: Optional[List[IndividualEvent]] = Field(None, max_items=100)
+    # Batch event handling (the 100-event cap is enforced by pydantic-core via max_length)
+    events: Optional[List[IndividualEvent]] = Field(None, max_length=100)
     
     # Additional event data
     eventData: Optional[Dict[str, Any]] = None
     batchMetadata: Optional[Dict[str, Any]] = None
     
-    @validator('events')
-    def validate_batch_size(cls, v):
-        if v is not None and len(v) > 100:
-            raise ValueError('Batch cannot exceed 100 events')
-        return v
-    
-    @validator('url')
+    @field_validator('url')
+    @classmethod
     def validate_url_format(cls, v):
         if v and not v.startswith(('http://', 'https://')):
             raise ValueError('URL must start with http:// or https://')
         return v
     
-    @validator('eventData')
+    @field_validator('eventData')
+    @classmethod
     def validate_event_data_size(cls, v):
         if v is None:
             return v
-        json_str = json.dumps(v)
-        if len(json_str.encode('utf-8')) > 10000:
+        if json_size(v) > 10000:
             raise ValueError('eventData exceeds 10KB limit')
         return v
 
@@ -84,7 +78,8 @@ class ClientIdPath(BaseModel):
     # Pydantic v2 fix: renamed from regex to pattern
     client_id: str = Field(..., pattern=r'^[a-zA-Z0-9_-]+$', max_length=100)
     
-    @validator('client_id')
+    @field_validator('client_id')
+    @classmethod
     def validate_client_id_format(cls, v):
         if not v or len(v) < 3:
             raise ValueError('client_id must be at least 3 characters')
@@ -16,7 +16,8 @@ CREATE TABLE IF NOT EXISTS events_log (
     processed_at TIMESTAMPTZ,
     client_id VARCHAR(255),           -- FIXED: Added client attribution column
     batch_id UUID,                    -- FIXED: Added missing batch_id referenced in README
-    export_status VARCHAR(20) DEFAULT 'pending'  -- FIXED: Added missing export_status column
+    export_status VARCHAR(20) DEFAULT 'pending',  -- FIXED: Added missing export_status column
+    claimed_at TIMESTAMPTZ            -- When an exporter claimed the row (stale claims are retried)
 );
 
 -- Create indexes for common queries (matching SQLAlchemy expectations)
@@ -24,12 +25,15 @@ CREATE INDEX IF NOT EXISTS idx_events_log_timestamp ON events_log(timestamp);
 CREATE INDEX IF NOT EXISTS idx_events_log_site_created ON events_log(site_id, created_at);
 CREATE INDEX IF NOT EXISTS idx_events_log_session ON events_log(session_id);
 CREATE INDEX IF NOT EXISTS idx_events_log_event_type ON events_log(event_type);
-CREATE INDEX IF NOT EXISTS idx_events_log_processed ON events_log(processed_at);
 CREATE INDEX IF NOT EXISTS idx_events_log_client_id ON events_log(client_id);
 CREATE INDEX IF NOT EXISTS idx_events_log_visitor_id ON events_log(visitor_id);  -- FIXED: Added missing index
 CREATE INDEX IF NOT EXISTS idx_events_log_created_at ON events_log(created_at);  -- FIXED: Added missing index
 CREATE INDEX IF NOT EXISTS idx_events_log_batch_id ON events_log(batch_id);      -- FIXED: Added batch index
-CREATE INDEX IF NOT EXISTS idx_events_log_export_status ON events_log(export_status);  -- FIXED: Added export index
+
+-- Partial indexes for the export queries (only pending rows are scanned for export)
+CREATE INDEX IF NOT EXISTS ix_events_pending ON events_log(created_at) WHERE processed_at IS NULL;
+CREATE INDEX IF NOT EXISTS ix_events_exported_at ON events_log(processed_at) WHERE processed_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_events_export_status ON events_log(export_status) WHERE export_status = 'pending';
 
 -- JSONB indexes for common queries
 CREATE INDEX IF NOT EXISTS idx_events_log_raw_data_gin ON events_log USING gin(raw_event_data);
\ No newline at end of file
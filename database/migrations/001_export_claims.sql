@@ -0,0 +1,27 @@
+-- One-off migration for databases created before the export claim / partial index changes.
+-- Fresh databases get all of this from 01_init.sql; the API never runs schema DDL itself.
+--
+-- Run once, outside a transaction (CONCURRENTLY can't run inside one, so no psql -1):
+--   docker compose exec -T postgres psql -U postgres -d postgres -v ON_ERROR_STOP=1 < database/migrations/001_export_claims.sql
+-- Every statement is idempotent, so the script can be re-run after a failure. A failed
+-- CREATE INDEX CONCURRENTLY leaves an INVALID index behind: drop it before re-running.
+
+-- Fail fast instead of queueing behind open export cursors (and blocking /collect inserts behind us)
+SET lock_timeout = '5s';
+
+-- Claim timestamp for reclaiming export batches left behind by a dead exporter.
+-- Metadata-only change (nullable, no default), but it still needs a brief ACCESS EXCLUSIVE lock
+ALTER TABLE events_log ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
+
+RESET lock_timeout;
+
+-- Partial indexes for the export queries, built without blocking writes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_events_pending ON events_log (created_at) WHERE processed_at IS NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_events_exported_at ON events_log (processed_at) WHERE processed_at IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_events_export_status ON events_log (export_status) WHERE export_status = 'pending';
+
+-- Full indexes replaced by the partial ones (01_init.sql and SQLAlchemy names), dropped once the new ones exist
+DROP INDEX CONCURRENTLY IF EXISTS idx_events_log_processed;
+DROP INDEX CONCURRENTLY IF EXISTS idx_events_log_export_status;
+DROP INDEX CONCURRENTLY IF EXISTS ix_events_log_processed_at;
+DROP INDEX CONCURRENTLY IF EXISTS ix_events_log_export_status;
@@ -7,40 +7,45 @@ Test the TRUE limits of bulk insert optimization
 import threading
 import time
 import random
-import statistics
-import queue
 import json
+from itertools import cycle, islice
 from datetime import datetime, timezone
 from typing import List, Dict, Any
 import concurrent.futures
+import numpy as np
 import psutil
 import requests
 import sys
 
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json, same wire format
+    orjson = None
+
+EVENT_TYPES = ("click", "scroll", "pageview", "form", "copy")
+
+def encode_json(payload: Any) -> bytes:
+    """Serialize a request body to UTF-8 JSON bytes (orjson when available)"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
 class DirectDatabaseStressTester:
     def __init__(self):
         self.api_url = "http://localhost:8000/collect"
-        self.results_queue = queue.Queue()
+        self.thread_results: List[Dict[str, Any]] = []
         self.total_events = 0
         self.total_requests = 0
         self.start_time = None
+        # Prime the non-blocking CPU sampler (its first reading is always 0.0)
+        psutil.cpu_percent(interval=None)
         
-    def generate_batch_event(self, batch_size: int, thread_id: int) -> Dict[str, Any]:
-        """Generate batch event optimized for speed"""
-        session_id = f"direct_{thread_id}_{random.randint(1000, 9999)}"
-        visitor_id = f"direct_{thread_id}_{random.randint(1000, 9999)}"
-        timestamp = datetime.now(timezone.utc).isoformat()
-        
-        # Pre-generated event types for speed
-        event_types = ["click", "scroll", "pageview", "form", "copy"]
-        
-        events = []
-        for i in range(batch_size - 1):
-            events.append({
-                "eventType": event_types[i % len(event_types)],
-                "timestamp": timestamp,
-                "eventData": {"thread": thread_id, "index": i}
-            })
+    def build_batch_event(self, batch_size: int, thread_id: int, session_id: str, visitor_id: str, timestamp: str) -> Dict[str, Any]:
+        """Batch event with the given per-request values"""
+        events = [
+            {"eventType": event_type, "timestamp": timestamp, "eventData": {"thread": thread_id, "index": i}}
+            for i, event_type in enumerate(islice(cycle(EVENT_TYPES), batch_size - 1))
+        ]
         
         return {
             "eventType": "batch",
@@ -57,6 +62,22 @@ class DirectDatabaseStressTester:
             }
         }
     
+    def batch_template(self, batch_size: int, thread_id: int) -> bytes:
+        """JSON skeleton of build_batch_event with %-placeholders for the per-request values
+        
+        Only the ids and timestamp vary between requests of one thread and batch size, so the
+        body is encoded once and each request just fills it in (see fill_batch_template).
+        """
+        return encode_json(self.build_batch_event(batch_size, thread_id, "%(session)s", "%(visitor)s", "%(ts)s"))
+    
+    def fill_batch_template(self, template: bytes, thread_id: int) -> bytes:
+        """Serialized batch event (as built by build_batch_event) from a batch_template skeleton"""
+        return template % {
+            b"session": b"direct_%d_%d" % (thread_id, random.randint(1000, 9999)),
+            b"visitor": b"direct_%d_%d" % (thread_id, random.randint(1000, 9999)),
+            b"ts": datetime.now(timezone.utc).isoformat().encode(),
+        }
+    
     def worker_thread(self, thread_id: int, events_per_second: float, duration: int, batch_size_range: tuple):
         """Single worker thread hitting database directly"""
         session = requests.Session()
@@ -66,44 +87,55 @@ class DirectDatabaseStressTester:
         batches_per_second = events_per_second / ((batch_size_range[0] + batch_size_range[1]) / 2)
         batch_interval = 1.0 / batches_per_second
         
+        # Every batch size this thread can draw, encoded up front so the loop never builds JSON
+        templates = {
+            size: self.batch_template(size, thread_id)
+            for size in range(batch_size_range[0], batch_size_range[1] + 1)
+        }
+        
         thread_start = time.perf_counter()
+        next_deadline = thread_start
         thread_events = 0
         thread_requests = 0
         thread_failures = 0
-        response_times = []
+        # Deadline pacing caps the thread at one request per batch_interval, so this never fills
+        response_times = np.empty(int(duration / batch_interval) + 2, dtype=np.float64)
         
         while time.perf_counter() - thread_start < duration:
             batch_size = random.randint(*batch_size_range)
-            batch_event = self.generate_batch_event(batch_size, thread_id)
+            body = self.fill_batch_template(templates[batch_size], thread_id)
             
             request_start = time.perf_counter()
             try:
-                response = session.post(self.api_url, json=batch_event, timeout=5)
+                response = session.post(self.api_url, data=body, timeout=5)
                 response_time = time.perf_counter() - request_start
                 
                 if response.status_code == 200:
+                    if thread_requests < response_times.size:
+                        response_times[thread_requests] = response_time
                     thread_events += batch_size
                     thread_requests += 1
-                    response_times.append(response_time)
                 else:
                     thread_failures += 1
                     
             except Exception as e:
                 thread_failures += 1
-                response_time = time.perf_counter() - request_start
             
-            # Precise timing control
-            time.sleep(max(0, batch_interval - response_time))
+            # Precise timing control: sleep to a fixed schedule so slow responses don't shift all
+            # later sends; when behind, send immediately and let the schedule catch up
+            next_deadline += batch_interval
+            delay = next_deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
         
-        # Store results
-        self.results_queue.put({
+        # Store results in this thread's own slot; merged once every thread has joined
+        self.thread_results[thread_id] = {
             "thread_id": thread_id,
             "events": thread_events,
             "requests": thread_requests,
             "failures": thread_failures,
-            "avg_response_time": statistics.mean(response_times) if response_times else 0,
-            "max_response_time": max(response_times) if response_times else 0
-        })
+            "response_times": response_times[:min(thread_requests, response_times.size)]
+        }
         
         session.close()
     
@@ -116,9 +148,8 @@ class DirectDatabaseStressTester:
         print(f"   Batch Size: {batch_size_range[0]}-{batch_size_range[1]} events")
         print(f"   Events per thread: {target_eps / num_threads:.1f}/second")
         
-        # Clear results queue
-        while not self.results_queue.empty():
-            self.results_queue.get()
+        # One result slot per thread
+        self.thread_results = [None] * num_threads
         
         # Get system stats before
         pre_stats = self.get_system_stats()
@@ -146,20 +177,11 @@ class DirectDatabaseStressTester:
         test_duration = time.perf_counter() - self.start_time
         
         # Collect results
-        thread_results = []
-        total_events = 0
-        total_requests = 0
-        total_failures = 0
-        all_response_times = []
-        
-        while not self.results_queue.empty():
-            result = self.results_queue.get()
-            thread_results.append(result)
-            total_events += result["events"]
-            total_requests += result["requests"]
-            total_failures += result["failures"]
-            if result["avg_response_time"] > 0:
-                all_response_times.append(result["avg_response_time"])
+        thread_results = [result for result in self.thread_results if result is not None]
+        total_events = sum(result["events"] for result in thread_results)
+        total_requests = sum(result["requests"] for result in thread_results)
+        total_failures = sum(result["failures"] for result in thread_results)
+        all_response_times = np.concatenate([result["response_times"] for result in thread_results]) if thread_results else np.empty(0)
         
         # Get system stats after
         post_stats = self.get_system_stats()
@@ -167,7 +189,9 @@ class DirectDatabaseStressTester:
         # Calculate final metrics
         actual_eps = total_events / test_duration
         success_rate = (total_requests / (total_requests + total_failures)) * 100 if (total_requests + total_failures) > 0 else 0
-        avg_response_time = statistics.mean(all_response_times) if all_response_times else 0
+        # Mean over every request (not a mean of per-thread means), computed in numpy
+        avg_response_time = float(all_response_times.mean()) if all_response_times.size else 0
+        p95_response_time = float(np.percentile(all_response_times, 95)) if all_response_times.size else 0
         
         return {
             "target_eps": target_eps,
@@ -178,6 +202,7 @@ class DirectDatabaseStressTester:
             "success_rate": success_rate,
             "test_duration": test_duration,
             "avg_response_time_ms": avg_response_time * 1000,
+            "p95_response_time_ms": p95_response_time * 1000,
             "pre_cpu": pre_stats["cpu_percent"],
             "post_cpu": post_stats["cpu_percent"],
             "pre_memory": pre_stats["memory_percent"], 
@@ -186,11 +211,16 @@ class DirectDatabaseStressTester:
         }
     
     def get_system_stats(self):
-        """Get system resource usage"""
+        """Get system resource usage
+        
+        cpu_percent is non-blocking and reports usage since the previous call, so the post-test
+        reading covers exactly the test window (and the pre-test one the idle gap before it).
+        """
+        memory = psutil.virtual_memory()
         return {
-            "cpu_percent": psutil.cpu_percent(interval=0.1),
-            "memory_percent": psutil.virtual_memory().percent,
-            "memory_available_gb": psutil.virtual_memory().available / (1024**3)
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": memory.percent,
+            "memory_available_gb": memory.available / (1024**3)
         }
     
     def run_escalating_test(self):
@@ -224,6 +254,7 @@ class DirectDatabaseStressTester:
             print(f"      Success Rate: {result['success_rate']:.1f}%")
             print(f"      Events: {result['total_events']:,}")
             print(f"      Avg Response: {result['avg_response_time_ms']:.1f}ms")
+            print(f"      P95 Response: {result['p95_response_time_ms']:.1f}ms")
             print(f"      CPU: {result['pre_cpu']:.1f}% → {result['post_cpu']:.1f}%")
             print(f"      Memory: {result['pre_memory']:.1f}% → {result['post_memory']:.1f}%")
             
@@ -255,10 +286,13 @@ def main():
     print("Bypassing AsyncIO to find TRUE database limits")
     print("=" * 50)
     
+    # One keep-alive connection for the baseline and final count probes
+    api_session = requests.Session()
+    
     # Get baseline
     print("📋 Getting baseline event count...")
     try:
-        response = requests.get("http://localhost:8000/events/count", timeout=5)
+        response = api_session.get("http://localhost:8000/events/count", timeout=5)
         if response.status_code == 200:
             baseline_events = response.json()["total_events"]
             print(f"   Baseline events: {baseline_events:,}")
@@ -321,7 +355,7 @@ def main():
     print(f"docker compose logs fastapi | grep 'Bulk inserted' | wc -l")
     
     try:
-        response = requests.get("http://localhost:8000/events/count", timeout=5)
+        response = api_session.get("http://localhost:8000/events/count", timeout=5)
         if response.status_code == 200:
             final_events = response.json()["total_events"]
             new_events = final_events - baseline_events
@@ -330,6 +364,8 @@ def main():
             print(f"   Total in database: {final_events:,}")
     except:
         print("Could not get final count")
+    finally:
+        api_session.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
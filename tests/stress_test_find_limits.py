@@ -9,38 +9,113 @@ import aiohttp
 import json
 import time
 import random
-import statistics
 from datetime import datetime, timezone
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import numpy as np
 import psutil
 import sys
+from collections import deque
+from itertools import islice
+
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json, same wire format
+    orjson = None
+
+# Response times kept per step for the p95 estimate, split across the step's workers.
+# Reservoir sampling bounds client memory at any EPS; 10k samples pin p95 to well under 1%
+RESPONSE_SAMPLE_SIZE = 10_000
+
+# Step summaries kept in memory for progress output; the full run is streamed to a JSONL file
+RECENT_RESULTS = 50
+
+def encode_json(payload: Any) -> bytes:
+    """Serialize a request body to UTF-8 JSON bytes (orjson when available)"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+def random_ints(rng: np.random.Generator, low: int, high: int, block: int = 65536):
+    """Endless stream of random ints in [low, high), drawn from numpy a block at a time
+    
+    One vectorized draw per block replaces a Python-level random call per value; the block
+    is converted to plain ints so consumers never handle numpy scalars.
+    """
+    while True:
+        yield from rng.integers(low, high, size=block).tolist()
+
+async def run_step_tasks(producer, worker, count: int) -> List[Any]:
+    """Run a step's producer and count workers; returns the results of the workers that finished
+    
+    On Python 3.11+ a TaskGroup cancels the rest of the step as soon as any task fails, instead
+    of letting gather(return_exceptions=True) hide the error until every worker is done.
+    """
+    if hasattr(asyncio, "TaskGroup"):
+        tasks = []
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(producer())
+                tasks = [tg.create_task(worker(i)) for i in range(count)]
+        except Exception as group:
+            print(f"   ⚠️  Step aborted by a failing task: {group!r}")
+        return [t.result() for t in tasks if not t.cancelled() and t.exception() is None]
+    
+    producer_task = asyncio.create_task(producer())
+    results = await asyncio.gather(*(worker(i) for i in range(count)), return_exceptions=True)
+    # Workers that stopped early leave the producer blocked on the bounded queue; no-op if it already finished
+    producer_task.cancel()
+    try:
+        await producer_task
+    except asyncio.CancelledError:
+        pass
+    return [r for r in results if not isinstance(r, BaseException)]
+
+def decode_json(line: bytes) -> Any:
+    """Inverse of encode_json"""
+    return orjson.loads(line) if orjson is not None else json.loads(line)
 
 class ExtremeStressTester:
     def __init__(self):
         self.api_url = "http://localhost:8000/collect"
-        self.results = []
+        self.results = deque(maxlen=RECENT_RESULTS)
+        self.results_path = f"stress_results_{int(time.time())}.jsonl"
+        self.steps_recorded = 0
         self.total_events_sent = 0
         self.total_requests_sent = 0
         self.start_time = None
         self.failure_threshold = 5  # Stop if >5% failure rate
         
-    def generate_batch_event(self, batch_size: int) -> Dict[str, Any]:
-        """Generate realistic batch event - optimized for speed"""
-        session_id = f"extreme_{random.randint(100000, 999999)}"
-        visitor_id = f"extreme_{random.randint(100000, 999999)}"
-        site_id = random.choice(["extreme-test-1", "extreme-test-2", "extreme-test-3"])
-        timestamp = datetime.now(timezone.utc).isoformat()
+        # Invariant parts of every generated batch, built once
+        self._event_types = ("click", "scroll", "pageview", "form", "copy")
+        self._site_ids = ("extreme-test-1", "extreme-test-2", "extreme-test-3")
+        self._site_id_bytes = tuple(site.encode() for site in self._site_ids)
+        self._batch_templates: Dict[int, bytes] = {}
+        rng = np.random.default_rng()
+        self._batch_sizes = random_ints(rng, 10, 19)  # Larger batches for extreme test
+        self._site_picks = random_ints(rng, 0, len(self._site_ids))
+        self._id_numbers = random_ints(rng, 0, 1 << 20)
+        self._ts_cache = (0.0, "", b"")  # (refreshed_at, iso string, encoded), see current_timestamp
         
-        # Generate events efficiently
-        events = []
-        event_types = ["click", "scroll", "pageview", "form", "copy"]
+        # Prime the non-blocking CPU sampler (its first reading is always 0.0)
+        psutil.cpu_percent(interval=None)
         
-        for i in range(batch_size - 1):
-            events.append({
-                "eventType": event_types[i % len(event_types)],
-                "timestamp": timestamp,
-                "eventData": {"index": i, "batch_test": True}
-            })
+    def current_timestamp(self) -> tuple[str, bytes]:
+        """UTC ISO timestamp, refreshed at most once per second (the server can't tell the difference)"""
+        now = time.time()
+        if now - self._ts_cache[0] >= 1.0:
+            iso = datetime.now(timezone.utc).isoformat()
+            self._ts_cache = (now, iso, iso.encode())
+        return self._ts_cache[1], self._ts_cache[2]
+    
+    def build_batch_event(self, batch_size: int, session_id: str, visitor_id: str, site_id: str, timestamp: str) -> Dict[str, Any]:
+        """Batch event with the given per-batch values"""
+        # Generate events efficiently (one timestamp string shared by the whole batch)
+        event_types = self._event_types
+        n_types = len(event_types)
+        events = [
+            {"eventType": event_types[i % n_types], "timestamp": timestamp, "eventData": {"index": i, "batch_test": True}}
+            for i in range(batch_size - 1)
+        ]
         
         return {
             "eventType": "batch",
@@ -57,17 +132,33 @@ class ExtremeStressTester:
             }
         }
     
-    async def send_batch_optimized(self, session: aiohttp.ClientSession, batch_size: int) -> tuple[bool, float, int]:
-        """Optimized batch sending with minimal overhead"""
-        batch_event = self.generate_batch_event(batch_size)
+    def encode_batch_event(self, batch_size: int) -> bytes:
+        """Serialized batch event (as built by build_batch_event), spliced into a cached JSON skeleton
+        
+        Everything but the ids, site and timestamp is fixed for a given batch size, so each
+        size is encoded once with %-placeholders and later requests only do bytes formatting.
+        """
+        template = self._batch_templates.get(batch_size)
+        if template is None:
+            template = encode_json(self.build_batch_event(batch_size, "%(session)s", "%(visitor)s", "%(site)s", "%(ts)s"))
+            self._batch_templates[batch_size] = template
+        
+        return template % {
+            b"session": b"extreme_%06d" % next(self._id_numbers),
+            b"visitor": b"extreme_%06d" % next(self._id_numbers),
+            b"site": self._site_id_bytes[next(self._site_picks)],
+            b"ts": self.current_timestamp()[1],
+        }
+    
+    async def send_batch_optimized(self, session: aiohttp.ClientSession, batch_size: int, payload: Optional[bytes] = None) -> tuple[bool, float, int]:
+        """Optimized batch sending with minimal overhead (payload may be pre-encoded by the caller)"""
+        # Encode before starting the clock; aiohttp's json= would run stdlib json.dumps per request
+        if payload is None:
+            payload = self.encode_batch_event(batch_size)
         
         start_time = time.perf_counter()
         try:
-            async with session.post(
-                self.api_url,
-                json=batch_event,
-                headers={"Content-Type": "application/json"}
-            ) as response:
+            async with session.post(self.api_url, data=payload) as response:
                 response_time = time.perf_counter() - start_time
                 success = response.status == 200
                 
@@ -81,14 +172,29 @@ class ExtremeStressTester:
             response_time = time.perf_counter() - start_time
             return False, response_time, batch_size
     
+    async def warm_up_connections(self, session: aiohttp.ClientSession, count: int):
+        """Open keep-alive connections up front so the first step doesn't pay connect costs"""
+        health_url = self.api_url.rsplit("/", 1)[0] + "/health"
+        
+        async def probe():
+            async with session.get(health_url) as response:
+                await response.read()
+        
+        results = await asyncio.gather(*(probe() for _ in range(count)), return_exceptions=True)
+        failures = sum(1 for r in results if isinstance(r, Exception))
+        print(f"   Warmed {count - failures}/{count} connections")
+    
     def get_system_stats(self):
-        """Get current system resource usage"""
+        """Get current system resource usage
+        
+        cpu_percent is non-blocking: it reports usage since the previous call, so calling this at
+        the start and end of a step measures CPU across the whole step with no 100ms stall.
+        """
+        memory = psutil.virtual_memory()
         return {
-            "cpu_percent": psutil.cpu_percent(interval=0.1),
-            "memory_percent": psutil.virtual_memory().percent,
-            "memory_available_gb": psutil.virtual_memory().available / (1024**3),
-            "disk_io": psutil.disk_io_counters()._asdict() if psutil.disk_io_counters() else {},
-            "network_io": psutil.net_io_counters()._asdict() if psutil.net_io_counters() else {}
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": memory.percent,
+            "memory_available_gb": memory.available / (1024**3)
         }
     
     async def progressive_load_test(self, start_eps: int, max_eps: int, step_eps: int, duration_per_step: int):
@@ -101,71 +207,111 @@ class ExtremeStressTester:
         print(f"   Failure threshold: {self.failure_threshold}%")
         print("=" * 60)
         
+        # No socket_factory needed for TCP_NODELAY: aiohttp's protocol enables it on every
+        # connection it makes, so small batch POSTs are never held back by Nagle
         connector = aiohttp.TCPConnector(
             limit=500,  # Increased connection pool
             limit_per_host=200,
-            keepalive_timeout=60,
-            enable_cleanup_closed=True
+            keepalive_timeout=120,  # Outlives the 5s cooldown so connections carry across steps
+            force_close=False
         )
         
         timeout = aiohttp.ClientTimeout(total=10, connect=2)
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
         
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
             
-            for target_eps in range(start_eps, max_eps + 1, step_eps):
+            await self.warm_up_connections(session, 100)  # one per worker at the worker cap
+            
+            # Adaptive stepping: double the step while the server is comfortably healthy, then
+            # once a step fails, bisect upward from the last good rate (never below step_eps)
+            target_eps = start_eps
+            step = step_eps
+            last_good_eps = None
+            cliff_seen = False
+            
+            while target_eps <= max_eps:
                 print(f"\n🚀 Testing {target_eps} events/second...")
                 
-                # System stats before test
+                # System stats before test (also starts the CPU sampling window for the step)
                 pre_stats = self.get_system_stats()
                 
-                # Reset counters
                 step_start_time = time.time()
-                step_events = 0
-                step_requests = 0
-                step_failures = 0
-                response_times = []
-                batch_sizes = []
                 
                 # Calculate batch timing for this step
                 target_batches_per_second = target_eps / 12  # Assume 12 events per batch average
                 batch_interval = 1.0 / target_batches_per_second
-                concurrent_workers = min(100, int(target_batches_per_second * 2))  # 2x batches as workers
+                concurrent_workers = max(1, min(100, int(target_batches_per_second * 2)))  # 2x batches as workers, at least one
                 
                 print(f"   Workers: {concurrent_workers}")
                 print(f"   Target batches/sec: {target_batches_per_second:.2f}")
                 
-                # Run load test for this step
-                tasks = []
+                # Run load test for this step: one producer issues batch tickets at the target
+                # rate, and concurrent_workers workers (the in-flight cap) send them. The bounded
+                # queue applies backpressure, so the rate no longer depends on the worker count
+                tickets = asyncio.Queue(maxsize=2 * concurrent_workers)
+                sample_per_worker = RESPONSE_SAMPLE_SIZE // concurrent_workers
+                loop = asyncio.get_running_loop()
+                
+                async def producer():
+                    # loop.time() is the loop's own monotonic clock, already used for its timers
+                    deadline = loop.time() + duration_per_step
+                    next_fire = loop.time()
+                    while loop.time() < deadline:
+                        # Encode here, while the producer would otherwise idle until the next tick, so
+                        # workers go straight from one response to the next send
+                        batch_size = next(self._batch_sizes)
+                        await tickets.put((batch_size, self.encode_batch_event(batch_size)))
+                        
+                        # Pace against a schedule: only yield to a timer when the wait is
+                        # worth it (>2ms), and resync instead of bursting when far behind
+                        next_fire += batch_interval
+                        now = loop.time()
+                        delay = next_fire - now
+                        if delay > 0.002:
+                            await asyncio.sleep(delay)
+                        elif delay < -0.05:
+                            next_fire = now
+                    
+                    for _ in range(concurrent_workers):
+                        await tickets.put(None)
                 
                 async def worker(worker_id: int):
-                    nonlocal step_events, step_requests, step_failures, response_times, batch_sizes
+                    """Send batches until the producer signals the end of the step; returns its own counters"""
+                    events = requests = failures = 0
+                    # Exact sum/max plus a uniform reservoir sample (Algorithm R) for percentiles
+                    rt_sum = rt_max = 0.0
+                    rt_sample = np.empty(sample_per_worker, dtype=np.float32)
                     
-                    worker_start = time.time()
-                    while time.time() - worker_start < duration_per_step:
-                        batch_size = random.randint(10, 18)  # Larger batches for extreme test
-                        
-                        success, response_time, actual_batch_size = await self.send_batch_optimized(session, batch_size)
+                    while (ticket := await tickets.get()) is not None:
+                        success, response_time, actual_batch_size = await self.send_batch_optimized(session, *ticket)
                         
                         if success:
-                            step_events += actual_batch_size
-                            step_requests += 1
-                            response_times.append(response_time)
-                            batch_sizes.append(actual_batch_size)
+                            if requests < sample_per_worker:
+                                rt_sample[requests] = response_time
+                            else:
+                                j = random.randrange(requests + 1)
+                                if j < sample_per_worker:
+                                    rt_sample[j] = response_time
+                            events += actual_batch_size
+                            requests += 1
+                            rt_sum += response_time
+                            rt_max = max(rt_max, response_time)
                         else:
-                            step_failures += 1
-                        
-                        # Brief pause to control rate
-                        await asyncio.sleep(batch_interval / concurrent_workers)
-                
-                # Start workers
-                for i in range(concurrent_workers):
-                    task = asyncio.create_task(worker(i))
-                    tasks.append(task)
+                            failures += 1
+                    
+                    return events, requests, failures, rt_sum, rt_max, rt_sample[:min(requests, sample_per_worker)]
                 
-                # Wait for completion
-                await asyncio.gather(*tasks, return_exceptions=True)
+                # Run producer and workers, then reduce the per-worker accumulators once
+                worker_results = await run_step_tasks(producer, worker, concurrent_workers)
+                step_events = sum(r[0] for r in worker_results)
+                step_requests = sum(r[1] for r in worker_results)
+                step_failures = sum(r[2] for r in worker_results)
                 
-                # Calculate step results
+                # Calculate step results. Workers share one FIFO queue, so their samples are equally
+                # representative and concatenate into one sample of the whole step
+                rt_sample = np.concatenate([r[5] for r in worker_results]) if worker_results else np.empty(0)
+                rt_max = max((r[4] for r in worker_results), default=0.0)
                 step_duration = time.time() - step_start_time
                 actual_eps = step_events / step_duration
                 success_rate = (step_requests / (step_requests + step_failures)) * 100 if (step_requests + step_failures) > 0 else 0
@@ -181,14 +327,14 @@ class ExtremeStressTester:
                     "total_events": step_events,
                     "total_requests": step_requests,
                     "failures": step_failures,
-                    "avg_response_ms": statistics.mean(response_times) * 1000 if response_times else 0,
-                    "p95_response_ms": statistics.quantiles(response_times, n=20)[18] * 1000 if len(response_times) >= 20 else (max(response_times) * 1000 if response_times else 0),
-                    "avg_batch_size": statistics.mean(batch_sizes) if batch_sizes else 0,
+                    "avg_response_ms": sum(r[3] for r in worker_results) / step_requests * 1000 if step_requests else 0,
+                    "p95_response_ms": float(np.percentile(rt_sample, 95)) * 1000 if step_requests >= 20 else rt_max * 1000,
+                    "avg_batch_size": step_events / step_requests if step_requests else 0,
                     "cpu_usage": post_stats["cpu_percent"],
                     "memory_usage": post_stats["memory_percent"]
                 }
                 
-                self.results.append(step_results)
+                self.record_step(step_results)
                 
                 # Print step results
                 print(f"   📊 Results:")
@@ -202,10 +348,12 @@ class ExtremeStressTester:
                 print(f"      Avg Batch Size: {step_results['avg_batch_size']:.1f}")
                 
                 # Check if we hit failure threshold
-                if success_rate < (100 - self.failure_threshold):
+                failed = success_rate < (100 - self.failure_threshold)
+                if failed and (step <= step_eps or last_good_eps is None):
                     print(f"\n🛑 FAILURE THRESHOLD REACHED!")
                     print(f"   Success rate {success_rate:.1f}% below {100 - self.failure_threshold}%")
-                    print(f"   Maximum capacity found: ~{target_eps - step_eps} EPS")
+                    capacity = last_good_eps if last_good_eps is not None else target_eps - step_eps
+                    print(f"   Maximum capacity found: ~{capacity} EPS")
                     break
                 
                 # Check if system resources are maxed
@@ -215,51 +363,92 @@ class ExtremeStressTester:
                     if target_eps < max_eps:
                         print(f"   Continuing to test higher loads...")
                 
+                # Pick the next target
+                if failed:
+                    cliff_seen = True
+                    step = max(step // 2, step_eps)
+                    next_eps = last_good_eps + step
+                    print(f"   🔎 Backing off: retrying at {next_eps} EPS")
+                else:
+                    last_good_eps = target_eps
+                    if cliff_seen:
+                        step = max(step // 2, step_eps)
+                    elif success_rate > 99 and step_results["p95_response_ms"] < 100:
+                        step = min(step * 2, max(step_eps, max_eps // 4))
+                    next_eps = target_eps + step
+                    # Always finish on max_eps itself rather than stepping past it
+                    if target_eps < max_eps < next_eps:
+                        next_eps = max_eps
+                
                 # Brief cooldown between steps
-                if target_eps < max_eps:
+                if next_eps <= max_eps:
                     print(f"   ⏳ Cooling down for 5 seconds...")
                     await asyncio.sleep(5)
+                
+                target_eps = next_eps
         
         return self.results
     
+    def record_step(self, step_results: Dict[str, Any]):
+        """Append a step summary to the results file, keeping only the most recent ones in memory"""
+        with open(self.results_path, "ab") as results_file:
+            results_file.write(encode_json(step_results) + b"\n")
+        self.results.append(step_results)
+        self.steps_recorded += 1
+    
+    def iter_recorded_steps(self):
+        """Stream every step summary of the run back from the results file"""
+        with open(self.results_path, "rb") as results_file:
+            for line in results_file:
+                yield decode_json(line)
+    
     def analyze_extreme_results(self) -> Dict[str, Any]:
         """Analyze extreme test results to find limits"""
-        if not self.results:
+        if not self.steps_recorded:
             return {"error": "No test results"}
         
-        # Find peak performance
-        successful_tests = [r for r in self.results if r["success_rate"] >= 95]
-        all_tests = self.results
-        
-        if successful_tests:
-            peak_eps = max(successful_tests, key=lambda x: x["actual_eps"])
-            max_throughput = max(r["actual_eps"] for r in successful_tests)
-        else:
-            peak_eps = max(all_tests, key=lambda x: x["actual_eps"]) if all_tests else {}
-            max_throughput = max(r["actual_eps"] for r in all_tests) if all_tests else 0
+        # One typed column per metric, reduced with vectorized masks instead of repeated passes over dicts
+        steps = np.array(
+            [(r["target_eps"], r["actual_eps"], r["success_rate"], r["p95_response_ms"], r["cpu_usage"], r["memory_usage"], r["total_events"])
+             for r in self.iter_recorded_steps()],
+            dtype=[("target_eps", "i8"), ("actual_eps", "f8"), ("success_rate", "f8"), ("p95_response_ms", "f8"),
+                   ("cpu_usage", "f8"), ("memory_usage", "f8"), ("total_events", "i8")]
+        )
         
-        # Resource analysis
-        max_cpu = max(r["cpu_usage"] for r in all_tests) if all_tests else 0
-        max_memory = max(r["memory_usage"] for r in all_tests) if all_tests else 0
+        # Find peak performance (among steps with >=95% success, else among all)
+        successful = steps["success_rate"] >= 95
+        candidates = np.flatnonzero(successful) if successful.any() else np.arange(len(steps))
+        peak_index = int(candidates[steps["actual_eps"][candidates].argmax()])
         
-        # Performance degradation analysis
-        degradation_point = None
-        for i, result in enumerate(all_tests):
-            if result["success_rate"] < 98 or result["p95_response_ms"] > 200:
-                degradation_point = result["target_eps"]
-                break
+        # Performance degradation analysis (adaptive stepping revisits rates, so take the lowest)
+        degraded = (steps["success_rate"] < 98) | (steps["p95_response_ms"] > 200)
+        degradation_point = int(steps["target_eps"][degraded].min()) if degraded.any() else None
         
         return {
-            "max_reliable_eps": max_throughput,
-            "peak_performance": peak_eps,
+            "max_reliable_eps": float(steps["actual_eps"][peak_index]),
+            "peak_performance": next(islice(self.iter_recorded_steps(), peak_index, None)),
             "degradation_starts_at": degradation_point,
-            "max_cpu_usage": max_cpu,
-            "max_memory_usage": max_memory,
-            "total_events_tested": sum(r["total_events"] for r in all_tests),
-            "test_steps_completed": len(all_tests)
+            "max_cpu_usage": float(steps["cpu_usage"].max()),
+            "max_memory_usage": float(steps["memory_usage"].max()),
+            "total_events_tested": int(steps["total_events"].sum()),
+            "test_steps_completed": len(steps)
         }
 
+def pin_client_cpus():
+    """Pin this process to cores 0-1 so scheduler migrations don't add jitter to response times
+    
+    Assumes the server under test runs on the remaining cores (e.g. docker --cpuset-cpus=2-N).
+    Skipped on small machines and where affinity isn't supported (macOS).
+    """
+    try:
+        if (psutil.cpu_count(logical=False) or 0) >= 4:
+            psutil.Process().cpu_affinity([0, 1])
+            print("📌 Client pinned to CPUs 0-1")
+    except (AttributeError, psutil.Error, OSError):
+        pass
+
 async def main():
+    pin_client_cpus()
     tester = ExtremeStressTester()
     
     print("🔥 EVOTHESIS EXTREME LIMITS TESTING")
@@ -277,9 +466,10 @@ async def main():
     
     print(f"\n🎯 Test Configuration:")
     print(f"   Range: {start_eps} → {max_eps} EPS")
-    print(f"   Step: {step_eps} EPS")
+    # Adaptive stepping (doubling while healthy, halving and revisiting after a failure) makes the
+    # step count, and so the total time, depend on the results
+    print(f"   Step: {step_eps} EPS minimum (adaptive)")
     print(f"   Duration: {duration}s per step")
-    print(f"   Estimated total time: {((max_eps - start_eps) // step_eps + 1) * duration // 60} minutes")
     
     confirm = input("\nProceed with extreme testing? (y/N): ")
     if confirm.lower() != 'y':
@@ -330,6 +520,8 @@ async def main():
     print(f"Production Revenue: ${monthly_revenue * server_multiplier:,.0f}/month")
     
     # Next steps
+    print(f"\nStep results: {tester.results_path}")
+    
     print(f"\n📋 VALIDATION COMMANDS")
     print("=" * 30)
     print(f"curl http://localhost:8000/events/count")
@@ -346,4 +538,12 @@ if __name__ == "__main__":
         subprocess.check_call([sys.executable, "-m", "pip", "install", "psutil"])
         import psutil
     
-    asyncio.run(main())
\ No newline at end of file
+    # uvloop's libuv loop dispatches the thousands of small POSTs per step with far less
+    # overhead, so the client saturates later and results track server capacity more closely
+    try:
+        import uvloop
+    except ImportError:
+        print("uvloop not installed; using the default asyncio loop (pip install uvloop for higher client EPS)")
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
\ No newline at end of file
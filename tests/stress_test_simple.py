@@ -9,10 +9,30 @@ import aiohttp
 import json
 import time
 import random
-import statistics
+from array import array
+from collections import deque
 from datetime import datetime, timezone
 from typing import List, Dict, Any
 import sys
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json, same wire format
+    orjson = None
+
+SITE_IDS = ("agency-client-1-com", "agency-client-2-com", "localhost")
+EVENT_TYPES = ("click", "scroll", "pageview", "form_focus", "text_copy")
+BATCH_SIZE_RANGE = (8, 15)  # Random batch size per send (optimal range)
+MAX_IN_FLIGHT = 64  # Concurrent requests cap; past it the schedule waits for a response
+WARM_UP_REQUESTS = 20  # Untimed requests before each phase
+RESPONSE_SAMPLE_SIZE = 10_000  # Response times kept per phase for percentiles
+
+def encode_json(payload: Any) -> bytes:
+    """Serialize a request body to UTF-8 JSON bytes (orjson when available)"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
 
 class SimpleStressTester:
     def __init__(self):
@@ -21,27 +41,37 @@ class SimpleStressTester:
         self.total_events_sent = 0
         self.total_requests_sent = 0
         self.start_time = None
+        # Per-phase response times: exact running mean/variance/max (Welford) plus a bounded
+        # reservoir sample for percentiles, reset by run_load_test and updated by send_batch
+        self.rt_mean = self.rt_m2 = self.rt_max = 0.0
+        self.response_times = array('d')
+        # Send exceptions are counted (and the latest few kept) rather than printed mid-phase
+        self.error_count = 0
+        self.recent_errors = deque(maxlen=16)
         
-    def generate_batch_event(self, batch_size: int) -> Dict[str, Any]:
-        """Generate realistic batch event"""
-        session_id = f"stress_sess_{random.randint(100000, 999999)}"
-        visitor_id = f"stress_vis_{random.randint(100000, 999999)}"
-        site_id = random.choice(["agency-client-1-com", "agency-client-2-com", "localhost"])
-        timestamp = datetime.now(timezone.utc).isoformat()
-        
-        # Generate individual events for the batch
-        events = []
-        event_types = ["click", "scroll", "pageview", "form_focus", "text_copy"]
-        
-        for _ in range(batch_size - 1):  # -1 because batch event itself counts
-            events.append({
-                "eventType": random.choice(event_types),
-                "timestamp": timestamp,
-                "eventData": {
-                    "test": True,
-                    "value": random.randint(1, 100)
-                }
-            })
+        # One JSON skeleton per batch size, encoded once (see encode_batch_event)
+        self._sites = tuple((site.encode(), site.replace('-', '.').encode()) for site in SITE_IDS)
+        self._payload_templates: Dict[int, bytes] = {
+            size: self.batch_template(size) for size in range(BATCH_SIZE_RANGE[0], BATCH_SIZE_RANGE[1] + 1)
+        }
+        self._ts_cache = (0.0, "", b"")  # (expires_at, iso string, encoded), see current_timestamp
+        
+    def current_timestamp(self) -> tuple[str, bytes]:
+        """UTC ISO timestamp, refreshed at most every 50ms (it's only a synthetic field)"""
+        now = time.monotonic()
+        if now >= self._ts_cache[0]:
+            iso = datetime.now(timezone.utc).isoformat()
+            self._ts_cache = (now + 0.05, iso, iso.encode())
+        return self._ts_cache[1], self._ts_cache[2]
+    
+    def build_batch_event(self, batch_size: int, session_id: str, visitor_id: str, site_id: str, host: str, timestamp: str) -> Dict[str, Any]:
+        """Batch event with the given per-batch values and randomly generated sub-events"""
+        # Generate individual events for the batch (-1 because batch event itself counts)
+        choice, rand = random.choice, random.getrandbits
+        events = [
+            {"eventType": choice(EVENT_TYPES), "timestamp": timestamp, "eventData": {"test": True, "value": 1 + rand(7) % 100}}
+            for _ in range(batch_size - 1)
+        ]
         
         return {
             "eventType": "batch",
@@ -49,7 +79,7 @@ class SimpleStressTester:
             "visitorId": visitor_id,
             "siteId": site_id,
             "timestamp": timestamp,
-            "url": f"https://{site_id.replace('-', '.')}/stress-test",
+            "url": f"https://{host}/stress-test",
             "path": "/stress-test",
             "events": events,
             "batchMetadata": {
@@ -58,99 +88,197 @@ class SimpleStressTester:
             }
         }
     
-    async def send_batch(self, session: aiohttp.ClientSession, batch_size: int) -> tuple[bool, float, int]:
-        """Send a batch event and measure performance"""
-        batch_event = self.generate_batch_event(batch_size)
+    def batch_template(self, batch_size: int) -> bytes:
+        """JSON skeleton of a batch event with %-placeholders for the per-request values"""
+        event = self.build_batch_event(batch_size, "%(session)s", "%(visitor)s", "%(site)s", "%(host)s", "%(ts)s")
+        return encode_json(event)
+    
+    def encode_batch_event(self, batch_size: int) -> bytes:
+        """Serialized batch event from the cached skeleton for its size
         
-        start_time = time.time()
+        The sub-events are randomized once per batch size at startup; each request only fills
+        in fresh ids, a site and the timestamp, so no dict building or JSON encoding runs per send.
+        """
+        rand = random.getrandbits
+        site_id, host = random.choice(self._sites)
+        return self._payload_templates[batch_size] % {
+            b"session": b"stress_sess_%d" % (100000 + rand(20) % 900000),
+            b"visitor": b"stress_vis_%d" % (100000 + rand(20) % 900000),
+            b"site": site_id,
+            b"host": host,
+            b"ts": self.current_timestamp()[1],
+        }
+    
+    async def send_batch(self, session: aiohttp.ClientSession, batch_size: int) -> None:
+        """Send a batch event and record its performance (failures are counted, never raised)"""
+        payload = self.encode_batch_event(batch_size)
+        
+        start_time = time.perf_counter()
         try:
-            async with session.post(
-                self.api_url,
-                json=batch_event,
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                response_time = time.time() - start_time
-                success = response.status == 200
+            async with session.post(self.api_url, data=payload) as response:
+                response_time = time.perf_counter() - start_time
                 
-                if success:
+                if response.status == 200:
                     self.total_events_sent += batch_size
                     self.total_requests_sent += 1
-                
-                return success, response_time, batch_size
-                
+                    self.record_response_time(response_time)
+        
         except Exception as e:
-            response_time = time.time() - start_time
-            print(f"Request failed: {e}")
-            return False, response_time, batch_size
+            self.error_count += 1
+            self.recent_errors.append(f"{type(e).__name__}: {e}")
+    
+    def record_response_time(self, response_time: float):
+        """Fold one successful request's time into the running stats (total_requests_sent counts it)"""
+        n = self.total_requests_sent
+        delta = response_time - self.rt_mean
+        self.rt_mean += delta / n
+        self.rt_m2 += delta * (response_time - self.rt_mean)
+        if response_time > self.rt_max:
+            self.rt_max = response_time
+        
+        # Uniform reservoir sample (Algorithm R) for the percentiles
+        sample = self.response_times
+        if n <= len(sample):
+            sample[n - 1] = response_time
+        else:
+            j = random.randrange(n)
+            if j < len(sample):
+                sample[j] = response_time
+    
+    def create_session(self) -> aiohttp.ClientSession:
+        """Keep-alive client session shared by all phases, so cooldowns don't drop pooled connections"""
+        # Pool sized to the in-flight cap so every concurrent send has a keep-alive connection
+        connector = aiohttp.TCPConnector(
+            limit=MAX_IN_FLIGHT,
+            limit_per_host=MAX_IN_FLIGHT,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,  # Outlives the 10s cooldowns between phases
+            force_close=False
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={"Content-Type": "application/json"},
+            skip_auto_headers=("User-Agent", "Accept-Encoding")
+        )
     
-    async def run_load_test(self, target_events_per_second: float, duration_seconds: int):
-        """Run load test with specified parameters"""
+    async def run_load_test(self, session: aiohttp.ClientSession, target_events_per_second: float, duration_seconds: int):
+        """Run load test with specified parameters on the given session (see create_session)"""
         print(f"\n🚀 Running Load Test:")
         print(f"   Target: {target_events_per_second} events/second")
         print(f"   Duration: {duration_seconds} seconds")
         print(f"   Expected total events: {target_events_per_second * duration_seconds:.0f}")
         
-        self.start_time = time.time()
         self.results = []
         self.total_events_sent = 0
         self.total_requests_sent = 0
+        self.error_count = 0
+        self.recent_errors.clear()
         
         # Calculate timing
         target_batches_per_second = target_events_per_second / 10  # Assume avg 10 events per batch
         batch_interval = 1.0 / target_batches_per_second
         
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            
-            # Schedule batch sends
-            for i in range(int(duration_seconds * target_batches_per_second)):
-                # Random batch size between 8-15 (optimal range)
-                batch_size = random.randint(8, 15)
-                
-                # Create task with delay
-                delay = i * batch_interval
-                task = asyncio.create_task(self._delayed_batch_send(session, delay, batch_size))
-                tasks.append(task)
-            
-            # Execute all tasks
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+        await self.warm_up(session)
+        self.start_time = time.perf_counter()
+        
+        # One producer paces the sends on a fixed schedule and starts each as its own task;
+        # only in-flight requests exist as tasks, and the semaphore caps how many that is
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        total_batches = int(duration_seconds * target_batches_per_second)
+        
+        # Fixed-size sample, so recording never grows a container mid-test
+        self.rt_mean = self.rt_m2 = self.rt_max = 0.0
+        self.response_times = array('d', [0.0]) * min(total_batches, RESPONSE_SAMPLE_SIZE)
+        
+        def send(batch_size: int):
+            return self._send_in_flight(in_flight, session, batch_size)
+        
+        if hasattr(asyncio, "TaskGroup"):
+            # Structured concurrency (3.11+): leaving the block waits for the sends still in
+            # flight, and an unexpected error in any of them cancels the rest of the phase
+            async with asyncio.TaskGroup() as tg:
+                await self._schedule_sends(total_batches, batch_interval, in_flight, send, tg.create_task)
+        else:
+            pending = set()
             
-            # Process results
-            success_count = 0
-            response_times = []
-            batch_sizes = []
+            def spawn(coro):
+                task = asyncio.create_task(coro)
+                pending.add(task)
+                task.add_done_callback(pending.discard)
             
-            for result in results:
-                if isinstance(result, tuple) and len(result) == 3:
-                    success, response_time, batch_size = result
-                    if success:
-                        success_count += 1
-                        response_times.append(response_time)
-                        batch_sizes.append(batch_size)
+            await self._schedule_sends(total_batches, batch_interval, in_flight, send, spawn)
+            # Drain the sends still in flight
+            await asyncio.gather(*pending, return_exceptions=True)
         
         # Calculate final statistics
-        elapsed_time = time.time() - self.start_time
-        success_rate = (success_count / len(tasks)) * 100 if tasks else 0
+        elapsed_time = time.perf_counter() - self.start_time
+        success_count = self.total_requests_sent
+        success_rate = (success_count / total_batches) * 100 if total_batches else 0
+        
+        # Percentiles from the filled part of the sample, read in place by numpy
+        rt_sample = np.frombuffer(self.response_times, dtype=np.float64)[:success_count]
+        percentiles = np.percentile(rt_sample, [50, 95, 99]) * 1000 if rt_sample.size else np.zeros(3)
         
         stats = {
             "duration_seconds": elapsed_time,
-            "total_requests": len(tasks),
+            "total_requests": total_batches,
             "successful_requests": success_count,
             "total_events_sent": self.total_events_sent,
             "success_rate": success_rate,
             "events_per_second": self.total_events_sent / elapsed_time,
             "requests_per_second": success_count / elapsed_time,
-            "avg_response_time_ms": statistics.mean(response_times) * 1000 if response_times else 0,
-            "max_response_time_ms": max(response_times) * 1000 if response_times else 0,
-            "avg_batch_size": statistics.mean(batch_sizes) if batch_sizes else 0,
+            "avg_response_time_ms": self.rt_mean * 1000,
+            "max_response_time_ms": self.rt_max * 1000,
+            "response_time_stddev_ms": (self.rt_m2 / (success_count - 1)) ** 0.5 * 1000 if success_count > 1 else 0,
+            "p50_response_time_ms": float(percentiles[0]),
+            "p95_response_time_ms": float(percentiles[1]),
+            "p99_response_time_ms": float(percentiles[2]),
+            "avg_batch_size": self.total_events_sent / success_count if success_count else 0,
+            "request_errors": self.error_count,
+            "recent_errors": list(self.recent_errors),
         }
         
         return stats
     
-    async def _delayed_batch_send(self, session: aiohttp.ClientSession, delay: float, batch_size: int):
-        """Send a batch after specified delay"""
-        await asyncio.sleep(delay)
-        return await self.send_batch(session, batch_size)
+    async def warm_up(self, session: aiohttp.ClientSession, count: int = WARM_UP_REQUESTS):
+        """Serial health probes before a phase, so connect, DNS and first-request costs aren't timed"""
+        health_url = self.api_url.rsplit("/", 1)[0] + "/health"
+        failures = 0
+        for _ in range(count):
+            try:
+                async with session.get(health_url) as response:
+                    await response.read()
+            except Exception:
+                failures += 1
+        print(f"   Warm-up: {count - failures}/{count} health probes ok")
+    
+    async def _schedule_sends(self, total_batches: int, batch_interval: float, in_flight: asyncio.Semaphore, send, spawn):
+        """Start total_batches sends batch_interval apart, each via spawn(send(batch_size))
+        
+        Sleeps to a fixed schedule rather than a fixed gap, so slow iterations don't drift the
+        rate, and waits for a free in-flight slot (released by the send) before each spawn.
+        """
+        loop = asyncio.get_running_loop()
+        next_send = loop.time()
+        
+        for _ in range(total_batches):
+            delay = next_send - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_send += batch_interval
+            
+            # Random batch size between 8-15 (optimal range)
+            batch_size = random.randint(*BATCH_SIZE_RANGE)
+            
+            await in_flight.acquire()
+            spawn(send(batch_size))
+    
+    async def _send_in_flight(self, in_flight: asyncio.Semaphore, session: aiohttp.ClientSession, batch_size: int):
+        """Send a batch holding an in-flight slot (acquired by the caller)"""
+        try:
+            await self.send_batch(session, batch_size)
+        finally:
+            in_flight.release()
     
     def print_results(self, stats: Dict[str, Any], test_name: str):
         """Print formatted test results"""
@@ -159,10 +287,13 @@ class SimpleStressTester:
         print(f"   Total Events: {stats['total_events_sent']:,}")
         print(f"   Events/Second: {stats['events_per_second']:.2f}")
         print(f"   Success Rate: {stats['success_rate']:.1f}%")
-        print(f"   Avg Response: {stats['avg_response_time_ms']:.1f}ms")
+        print(f"   Avg Response: {stats['avg_response_time_ms']:.1f}ms (stddev {stats['response_time_stddev_ms']:.1f}ms)")
+        print(f"   P50/P95/P99 Response: {stats['p50_response_time_ms']:.1f}/{stats['p95_response_time_ms']:.1f}/{stats['p99_response_time_ms']:.1f}ms")
         print(f"   Max Response: {stats['max_response_time_ms']:.1f}ms")
         print(f"   Avg Batch Size: {stats['avg_batch_size']:.1f}")
         print(f"   Requests/Second: {stats['requests_per_second']:.2f}")
+        if stats['request_errors']:
+            print(f"   Request Errors: {stats['request_errors']:,} (latest: {stats['recent_errors'][-1]})")
 
 async def main():
     tester = SimpleStressTester()
@@ -170,30 +301,31 @@ async def main():
     print("🔬 Evothesis Bulk Insert Performance Test")
     print("=" * 45)
     
-    # Test 1: Light Load (2 events/second for 60 seconds)
-    print("\n🔄 Phase 1: Light Load Test (Bulk Processing Verification)")
-    light_stats = await tester.run_load_test(2.0, 60)
-    tester.print_results(light_stats, "Light Load (2 EPS)")
-    
-    if light_stats['success_rate'] < 95:
-        print("❌ Light load test failed. Stopping.")
-        return
-    
-    print("\n⏳ Cooling down for 10 seconds...")
-    await asyncio.sleep(10)
-    
-    # Test 2: Agency Client Load (6 events/second for 300 seconds)
-    print("\n🎯 Phase 2: Agency Client Simulation (6 EPS × 5 minutes)")
-    agency_stats = await tester.run_load_test(6.0, 300)
-    tester.print_results(agency_stats, "Agency Client Load (6 EPS)")
-    
-    print("\n⏳ Cooling down for 10 seconds...")
-    await asyncio.sleep(10)
-    
-    # Test 3: Burst Capacity (15 events/second for 60 seconds)
-    print("\n💥 Phase 3: Burst Capacity Test (Peak Traffic)")
-    burst_stats = await tester.run_load_test(15.0, 60)
-    tester.print_results(burst_stats, "Burst Capacity (15 EPS)")
+    async with tester.create_session() as session:
+        # Test 1: Light Load (2 events/second for 60 seconds)
+        print("\n🔄 Phase 1: Light Load Test (Bulk Processing Verification)")
+        light_stats = await tester.run_load_test(session, 2.0, 60)
+        tester.print_results(light_stats, "Light Load (2 EPS)")
+        
+        if light_stats['success_rate'] < 95:
+            print("❌ Light load test failed. Stopping.")
+            return
+        
+        print("\n⏳ Cooling down for 10 seconds...")
+        await asyncio.sleep(10)
+        
+        # Test 2: Agency Client Load (6 events/second for 300 seconds)
+        print("\n🎯 Phase 2: Agency Client Simulation (6 EPS × 5 minutes)")
+        agency_stats = await tester.run_load_test(session, 6.0, 300)
+        tester.print_results(agency_stats, "Agency Client Load (6 EPS)")
+        
+        print("\n⏳ Cooling down for 10 seconds...")
+        await asyncio.sleep(10)
+        
+        # Test 3: Burst Capacity (15 events/second for 60 seconds)
+        print("\n💥 Phase 3: Burst Capacity Test (Peak Traffic)")
+        burst_stats = await tester.run_load_test(session, 15.0, 60)
+        tester.print_results(burst_stats, "Burst Capacity (15 EPS)")
     
     # Final Assessment
     print(f"\n🏆 Performance Assessment:")
@@ -235,4 +367,10 @@ async def main():
     print(f"   4. Review database performance: docker compose logs postgres | tail -20")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # uvloop's libuv loop adds less client-side overhead to the measured response times
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
\ No newline at end of file